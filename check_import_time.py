@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+# Check that importing the tools stays within a startup time budget.
+# Heavy dependencies (extractors, fasttext, etc.) should be imported on
+# first use so that short-lived invocations don't pay for them.
+
+import os
+import re
+import sys
+import subprocess
+
+from argparse import ArgumentParser
+
+
+# Modules to check by default
+DEFAULT_MODULES = [
+    'common',
+    'check_warc',
+    'compact_warcs',
+    'compute_warc_hashes',
+    'convert_warc',
+    'extract_warc_text',
+    'filter_warc',
+    'find_duplicates',
+    'langdetect_warc',
+    'pipeline',
+    'plan_tasks',
+    'sample_warc_responses',
+    'select_from_wat',
+    'select_language',
+    'telemetry_summary',
+    'warc_files',
+    'warc_reader',
+    'warc_worker',
+]
+
+# Line format of python -X importtime output
+_IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+)\s*\|\s*(\d+)\s*\|(\s*)(\S+)')
+
+
+def argparser():
+    ap = ArgumentParser(description='Check import time of tools')
+    ap.add_argument('-b', '--budget', metavar='MS', type=float, default=100,
+                    help='maximum cumulative import time in milliseconds')
+    ap.add_argument('-r', '--repeat', metavar='N', type=int, default=3,
+                    help='measure N times and use the fastest')
+    ap.add_argument('-s', '--slowest', metavar='N', type=int, default=5,
+                    help='show N slowest imports for modules over budget')
+    ap.add_argument('module', nargs='*', default=DEFAULT_MODULES)
+    return ap
+
+
+def measure_import_time(module):
+    # Returns cumulative time in microseconds for importing module and
+    # list of (cumulative time, name) for its imports
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    # nested imports are listed before the importing module with
+    # deeper indentation
+    total, imports = None, []
+    for line in result.stderr.splitlines():
+        m = _IMPORTTIME_RE.match(line)
+        if not m:
+            continue
+        cumulative, depth, name = int(m.group(2)), len(m.group(3)), m.group(4)
+        if depth > 1:
+            imports.append((cumulative, name))
+        elif name == module:
+            total = cumulative
+            break
+        else:
+            imports = []
+    if total is None:
+        raise ValueError(f'failed to measure import time for {module}')
+    return total, imports
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+
+    over_budget = 0
+    for module in args.module:
+        measurements = [
+            measure_import_time(module) for _ in range(args.repeat)
+        ]
+        total, imports = min(measurements)
+        ms = total / 1000
+        if ms <= args.budget:
+            print(f'{module}: OK: {ms:.1f} ms')
+        else:
+            over_budget += 1
+            print(f'{module}: OVER BUDGET: {ms:.1f} ms > {args.budget} ms')
+            for cumulative, name in sorted(imports, reverse=True)[:args.slowest]:
+                print(f'    {cumulative/1000:.1f} ms\t{name}')
+
+    return 1 if over_budget else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -1,42 +1,213 @@
 #!/usr/bin/env python3
 
+# Check that WARC files can be read. With --fast, only walk the gzip
+# member structure and WARC header framing of per-record-gzip WARCs,
+# checking gzip CRCs and record lengths without parsing the records.
+# With --digests, also verify WARC-Block-Digest and WARC-Payload-Digest
+# values, computing the digests incrementally while streaming records.
+# Error offsets are offsets of the failing record in the uncompressed
+# data, or in the compressed file with --fast.
+
+import os
 import sys
 import gzip
+import json
 
+from time import time
+from functools import partial
+from collections import defaultdict
+from multiprocessing import Pool
 from argparse import ArgumentParser
-from warcio.archiveiterator import ArchiveIterator
+
+from telemetry import add_telemetry_arguments, track_members, track_progress
+from warc_members import inflate_member, read_member_record, mmap_file
+
+
+# Fields of --report output
+REPORT_FIELDS = [
+    'file', 'status', 'records', 'bytes', 'seconds', 'digests_checked',
+    'digest_mismatches', 'error_offset', 'error',
+]
+
+# Supported --report formats
+REPORT_FORMATS = ['tsv', 'json']
+
+# Blank lines terminating WARC records
+_RECORD_END = b'\r\n\r\n'
 
 
 def argparser():
     ap = ArgumentParser()
+    ap.add_argument('-f', '--fast', default=False, action='store_true',
+                    help='only check gzip members and WARC header framing '
+                    '(per-record-gzip WARCs only)')
+    ap.add_argument('-d', '--digests', default=False, action='store_true',
+                    help='verify block and payload digests')
+    ap.add_argument('-j', '--processes', metavar='N', type=int, default=1,
+                    help='check N files in parallel')
+    ap.add_argument('-r', '--report', metavar='FILE', default=None,
+                    help='write per-file results to FILE')
+    ap.add_argument('--report-format', choices=REPORT_FORMATS, default=None,
+                    help='format of --report (default by file suffix, tsv)')
     ap.add_argument('-q', '--quiet', default=False, action='store_true')
     ap.add_argument('-v', '--verbose', default=False, action='store_true')
+    add_telemetry_arguments(ap)
     ap.add_argument('warc', nargs='+')
     return ap
 
 
-def check_warc(warc_stream, options):
-    for total, record in enumerate(ArchiveIterator(warc_stream), start=1):
-        pass
-    return total
+def check_warc(warc_stream, result, stats, options):
+    from warcio.archiveiterator import ArchiveIterator    # deferred
+
+    # with check_digests, warcio updates the digests as read_to_end()
+    # reads the record in fixed-size chunks
+    iterator = ArchiveIterator(warc_stream, check_digests=options.digests)
+    mismatch_offset, mismatch = None, None
+    for record in iterator:
+        offset = iterator.get_record_offset()
+        result['error_offset'] = offset
+        iterator.read_to_end(record)
+        stats['total'] += 1
+        if options.digests and record.digest_checker.passed is not None:
+            result['digests_checked'] += 1
+            if record.digest_checker.passed is False:
+                result['digest_mismatches'] += 1
+                if mismatch is None:
+                    mismatch_offset = offset
+                    mismatch = '; '.join(record.digest_checker.problems)
+    result['error_offset'] = None
+    if mismatch is not None:
+        result['error_offset'] = mismatch_offset
+        raise ValueError(f'{result["digest_mismatches"]} digest mismatches, '
+                         f'first: {mismatch}')
+    return stats['total']
+
+
+def check_warc_members(buf, result, stats, progress, options):
+    offset = 0
+    while offset < len(buf):
+        result['error_offset'] = offset
+        record = read_member_record(buf, offset)
+        # inflating the member checks the gzip CRC and ISIZE
+        size, tail = 0, b''
+        for data in inflate_member(buf, offset, record.length):
+            size += len(data)
+            tail = (tail + data)[-len(_RECORD_END):]
+        expected = record.header_length + record.content_length + \
+            len(_RECORD_END)
+        if size != expected:
+            raise ValueError(f'record length {size} != {expected}')
+        if tail != _RECORD_END:
+            raise ValueError('record not terminated by blank lines')
+        offset += record.length
+        stats['total'] += 1
+        if progress is not None:
+            progress.update(compressed=offset)
+    result['error_offset'] = None
+    return stats['total']
+
+
+def check_warc_file(fn, options):
+    result = {
+        'file': fn,
+        'status': 'OK',
+        'records': 0,
+        'bytes': 0,
+        'seconds': 0,
+        'digests_checked': 0,
+        'digest_mismatches': 0,
+        'error_offset': None,
+        'error': None,
+    }
+    if options.verbose:
+        print(f'Start checking {fn} ...', file=sys.stderr)
+    start = time()
+    stats = defaultdict(int)
+    try:
+        result['bytes'] = os.path.getsize(fn)
+        if options.fast:
+            with mmap_file(fn) as buf:
+                with track_members(fn, stats, options) as progress:
+                    check_warc_members(buf, result, stats, progress, options)
+        else:
+            with gzip.open(fn) as f:
+                with track_progress(f, fn, stats, options) as f:
+                    check_warc(f, result, stats, options)
+    except Exception as e:
+        result['status'] = 'ERROR'
+        result['error'] = str(e).replace('\n', ' ')
+    result['records'] = stats['total']
+    result['seconds'] = round(time()-start, 3)
+    if options.verbose:
+        print(f'Done {fn}.', file=sys.stderr)
+    return result
+
+
+def check_warc_files(fns, options):
+    # Yields results in order, checking files in worker processes only
+    # if more than one is requested
+    check = partial(check_warc_file, options=options)
+    if options.processes > 1:
+        with Pool(options.processes) as pool:
+            yield from pool.imap(check, fns)
+    else:
+        yield from map(check, fns)
+
+
+def write_report(results, fn, format_):
+    with open(fn, 'w', encoding='utf-8') as out:
+        if format_ == 'json':
+            json.dump(results, out, indent=2)
+            out.write('\n')
+        else:
+            print('\t'.join(REPORT_FIELDS), file=out)
+            for result in results:
+                values = ['' if result[f] is None else str(result[f])
+                          for f in REPORT_FIELDS]
+                print('\t'.join(values), file=out)
 
 
 def main(argv):
     args = argparser().parse_args(argv[1:])
 
-    for fn in args.warc:
-        if args.verbose:
-            print(f'Start checking {fn} ...', file=sys.stderr)
-        try:
-            with gzip.open(fn) as f:
-                total = check_warc(f, args)
+    if args.fast and args.digests:
+        argparser().error('--digests requires parsing records, not --fast')
+
+    if args.report_format is None:
+        if args.report is not None and args.report.endswith('.json'):
+            args.report_format = 'json'
+        else:
+            args.report_format = 'tsv'
+
+    results = []
+    start = time()
+    for result in check_warc_files(args.warc, args):
+        fn = result['file']
+        if result['status'] == 'OK':
             if not args.quiet:
-                print(f'{fn}: OK: {total} records')
-        except Exception as e:
-            error_str = str(e).replace('\n', ' ')
-            print(f'{fn}: ERROR: {error_str}')
-        if args.verbose:
-            print(f'Done {fn}.', file=sys.stderr)
+                print(f'{fn}: OK: {result["records"]} records')
+        else:
+            print(f'{fn}: ERROR: {result["error"]}')
+        results.append(result)
+
+    if args.verbose or args.digests:
+        seconds = time() - start
+        total_bytes = sum(r['bytes'] for r in results)
+        total_records = sum(r['records'] for r in results)
+        print(f'checked {len(results)} files, {total_records} records, '
+              f'{total_bytes/2**20:.1f} MB in {seconds:.1f} sec '
+              f'({total_bytes/2**20/seconds:.1f} MB/s, '
+              f'{total_records/seconds:.0f} records/s)', file=sys.stderr)
+        if args.digests:
+            checked = sum(r['digests_checked'] for r in results)
+            mismatches = sum(r['digest_mismatches'] for r in results)
+            print(f'verified digests of {checked} records, {mismatches} '
+                  f'mismatches', file=sys.stderr)
+
+    if args.report is not None:
+        write_report(results, args.report, args.report_format)
+
+    return 1 if any(r['status'] != 'OK' for r in results) else 0
 
 
 if __name__ == '__main__':
@@ -1,7 +1,8 @@
 import sys
+import hashlib
 import logging
 
-import trafilatura
+from io import BytesIO
 
 
 # Mime types for plain text
@@ -42,6 +43,17 @@ _UNSUPPORTED_MAIN_MIME_TYPES = {
     'application',
 }
 
+# Bytes read at a time when streaming payloads
+CHUNK_SIZE = 2**16
+
+# Multipliers for size suffixes
+_SIZE_UNITS = {
+    'K': 2**10,
+    'M': 2**20,
+    'G': 2**30,
+    'T': 2**40,
+}
+
 
 def is_response(record):
     return record.rec_type == 'response'
@@ -96,7 +108,19 @@ def get_mime_type(record):
         return record.rec_headers.get_header('Content-Type')
 
 
+def is_hash_sampled(key, ratio):
+    # Deterministic sampling: a given key is always either in or out of
+    # the sample for a given ratio, regardless of processing order
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') < ratio * 2**64
+
+
+def replace_unicode_errors(string):
+    return string.encode('utf-8', 'replace').decode('utf-8')
+
+
 def get_text_content(id_, mime_type, content, trafilatura_options=None):
+    import trafilatura    # deferred, slow to import
     if trafilatura_options is None:
         trafilatura_options = {}
     if is_plain_text_mime_type(mime_type):
@@ -109,14 +133,17 @@ def get_text_content(id_, mime_type, content, trafilatura_options=None):
         return trafilatura.extract(content, **trafilatura_options)
 
 
-def get_record_text_content(record, trafilatura_options=None):
+def get_record_text_content(record, trafilatura_options=None,
+                            max_payload=None, truncate=False):
     id_ = get_record_id(record)
     if record.rec_type != 'response':
         raise ValueError(f'non-response record {id_}')
     mime_type = get_payload_type(record)
     if is_unsupported_mime_type(mime_type):
         raise ValueError(f'unsupported mime type {mime_type} for {id_}')
-    content = record.content_stream().read()
+    content, complete = read_payload(record, max_payload, truncate)
+    if not complete and not truncate:
+        raise ValueError(f'payload over {max_payload} bytes for {id_}')
     if not content:
         raise ValueError(f'empty content for {id_}')
     try:
@@ -128,9 +155,88 @@ def get_record_text_content(record, trafilatura_options=None):
     return text
 
 
+def parse_size(string):
+    unit = string[-1:].upper()
+    if unit in _SIZE_UNITS:
+        return int(float(string[:-1]) * _SIZE_UNITS[unit])
+    else:
+        return int(string)
+
+
+def get_memory_usage():
+    # Memory usage of the current process in kB. RSS counts pages shared
+    # with other processes in full; PSS divides them between the sharers.
+    usage = {}
+    for fn, keys in (
+        ('/proc/self/status', ('VmRSS', 'VmHWM')),
+        ('/proc/self/smaps_rollup', ('Pss', 'Shared_Clean', 'Shared_Dirty',
+                                     'Private_Clean', 'Private_Dirty')),
+    ):
+        try:
+            with open(fn) as f:
+                for line in f:
+                    key, _, value = line.partition(':')
+                    if key in keys:
+                        usage[key] = int(value.split()[0])
+        except OSError:
+            pass    # not Linux or too old kernel
+    return usage
+
+
+def buffer_payload(record):
+    # Read the raw payload once and make it re-readable so that e.g.
+    # content can be decoded and the record still written out (see
+    # https://github.com/webrecorder/warcio/issues/114). BytesIO shares
+    # the buffer of the bytes object instead of copying it, and reading
+    # all of an unencoded payload returns that same object.
+    payload = record.raw_stream.read()
+    record.raw_stream = BytesIO(payload)
+    record.payload_length = len(payload)
+    return record
+
+
+def payload_length(record):
+    # Length of the (encoded) payload from headers, or None if unknown
+    if record.payload_length is not None and record.payload_length >= 0:
+        return record.payload_length
+    return record.length
+
+
+def is_oversize(record, max_bytes):
+    if max_bytes is None:
+        return False
+    length = payload_length(record)
+    return length is not None and length > max_bytes
+
+
+def read_payload(record, max_bytes=None, truncate=False):
+    # Returns (payload, complete). If the payload is over max_bytes,
+    # complete is False and payload is its first max_bytes bytes with
+    # truncate, and empty otherwise.
+    stream = record.content_stream()
+    if max_bytes is None:
+        return stream.read(), True
+    if not truncate and is_oversize(record, max_bytes):
+        return b'', False
+    payload = stream.read(max_bytes+1)
+    if len(payload) > max_bytes:
+        return (payload[:max_bytes] if truncate else b''), False
+    return payload, True
+
+
+def hash_payload(record, digest_size=16, chunk_size=CHUNK_SIZE):
+    # Hash of the decoded payload read in chunks
+    hash_ = hashlib.blake2b(digest_size=digest_size)
+    stream = record.content_stream()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        hash_.update(chunk)
+    return hash_.digest()
+
+
 def set_trafilatura_loglevel(level):
-    try:
-        trafilatura.core.LOGGER.setLevel(level)
-        trafilatura.utils.LOGGER.setLevel(level)
-    except:
-        logging.warning('Failed to set trafilatura log level')
+    # set on the parent of the trafilatura module loggers so that
+    # trafilatura doesn't need to be imported just to configure logging
+    logging.getLogger('trafilatura').setLevel(level)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+# Merge many small per-record-gzip WARC files into fewer large ones of
+# roughly a target size. gzip members are copied as they are (no
+# decompression or recompression), so each output is a valid
+# per-record-gzip WARC. Each output OUT gets an index OUT.idx with one
+# line per record giving its offset and length in OUT together with the
+# file and offset it was copied from.
+
+import os
+import sys
+import logging
+
+from collections import defaultdict
+from argparse import ArgumentParser
+
+from common import parse_size
+from warc_members import iter_member_records, mmap_file
+
+
+# Format of output file names
+OUTPUT_FORMAT = '{prefix}-{number:05d}.warc.gz'
+
+# Suffix of index files
+INDEX_SUFFIX = '.idx'
+
+
+def argparser():
+    ap = ArgumentParser(description='Merge per-record-gzip WARC files')
+    ap.add_argument('-s', '--target-size', metavar='SIZE', type=parse_size,
+                    default='1G', help='target output file size '
+                    '(e.g. 500M, 1G)')
+    ap.add_argument('-l', '--list', metavar='FILE', default=None,
+                    help='read input file names from FILE, one per line')
+    ap.add_argument('-v', '--verbose', default=False, action='store_true')
+    ap.add_argument('output_prefix', help='output path prefix')
+    ap.add_argument('warc', nargs='*')
+    return ap
+
+
+class CompactWriter:
+    # Writes members to numbered outputs, starting a new one when adding
+    # a file would exceed the target size. Outputs and indexes are
+    # written to temporary files and renamed when complete.
+    def __init__(self, prefix, target_size):
+        self.prefix = prefix
+        self.target_size = target_size
+        self.number = -1
+        self.out = None
+        self.index = None
+        self.fn = None
+        self.size = 0
+        self.outputs = []
+
+    def open_next(self):
+        self.close()
+        self.number += 1
+        self.fn = OUTPUT_FORMAT.format(prefix=self.prefix, number=self.number)
+        os.makedirs(os.path.dirname(self.fn) or '.', exist_ok=True)
+        self.out = open(f'{self.fn}.tmp', 'wb')
+        self.index = open(f'{self.fn}{INDEX_SUFFIX}.tmp', 'w',
+                          encoding='utf-8')
+        self.size = 0
+
+    def write_file(self, fn, buf, records):
+        # Write members of input file fn. Files are not split between
+        # outputs unless a single file exceeds the target size.
+        length = sum(r.length for r in records)
+        if (self.out is None or
+            (self.size > 0 and self.size + length > self.target_size)):
+            self.open_next()
+        for record in records:
+            if self.size > 0 and self.size+record.length > self.target_size:
+                self.open_next()
+            self.out.write(buf[record.offset:record.offset+record.length])
+            id_ = record.rec_headers.get_header('WARC-Record-ID')
+            print(f'{id_}\t{self.size}\t{record.length}\t{fn}\t'
+                  f'{record.offset}', file=self.index)
+            self.size += record.length
+
+    def close(self):
+        if self.out is None:
+            return
+        self.out.close()
+        self.index.close()
+        os.replace(f'{self.fn}.tmp', self.fn)
+        os.replace(f'{self.fn}{INDEX_SUFFIX}.tmp', f'{self.fn}{INDEX_SUFFIX}')
+        self.outputs.append((self.fn, self.size))
+        self.out = None
+
+
+def compact_warcs(fns, writer, stats):
+    for fn in fns:
+        with mmap_file(fn) as buf:
+            try:
+                # walk all members before writing any so that invalid
+                # files are skipped entirely
+                records = list(iter_member_records(buf))
+            except Exception as e:
+                logging.error(f'skipping {fn}: {e}')
+                stats['files skipped'] += 1
+                continue
+            writer.write_file(fn, buf, records)
+        stats['files'] += 1
+        stats['records'] += len(records)
+        stats['bytes'] += sum(r.length for r in records)
+        if stats['files'] % 1000 == 0:
+            logging.info(f'processed {stats["files"]} files, '
+                         f'{stats["records"]} records')
+
+
+def read_file_list(fn):
+    with open(fn, encoding='utf-8') as f:
+        return [l.strip() for l in f if l.strip()]
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+
+    logging.basicConfig()
+    if args.verbose:
+        logging.getLogger().setLevel(logging.INFO)
+
+    fns = args.warc
+    if args.list is not None:
+        fns = fns + read_file_list(args.list)
+    if not fns:
+        print('no input files', file=sys.stderr)
+        return 1
+
+    stats = defaultdict(int)
+    writer = CompactWriter(args.output_prefix, args.target_size)
+    compact_warcs(fns, writer, stats)
+    writer.close()
+
+    for fn, size in writer.outputs:
+        print(f'{fn}\t{size}')
+    print(f'Done, {stats["files"]} files ({stats["files skipped"]} skipped), '
+          f'{stats["records"]} records, {stats["bytes"]} bytes in '
+          f'{len(writer.outputs)} outputs', file=sys.stderr)
+    return 1 if stats['files skipped'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
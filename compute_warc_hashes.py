@@ -4,7 +4,6 @@
 
 import sys
 import re
-import os
 import gzip
 import base64
 import logging
@@ -12,12 +11,26 @@ import logging
 import mmh3
 
 from collections import defaultdict
-from glob import glob
 from argparse import ArgumentParser
 
-from bs4 import BeautifulSoup
 from warcio.archiveiterator import ArchiveIterator
 
+from manifest import open_manifest
+from telemetry import add_telemetry_arguments, track_progress
+from memprofile import (
+    add_memory_profile_arguments,
+    get_profiler,
+    write_memory_profile,
+)
+from common import hash_payload, is_oversize
+from payload_cap import (
+    OVERSIZE_ACTIONS,
+    OVERSIZE_STATS,
+    add_payload_cap_arguments,
+    read_capped_payload,
+    write_cap_stats,
+)
+from warc_files import iter_paths
 
 # Mime types for plain text
 _PLAIN_TEXT_MIME_TYPES = {
@@ -65,8 +78,16 @@ def argparser():
                     help='use "WARC-Refers-To" as ID (for WET files)')
     ap.add_argument('-n', '--no-norm', default=False, action='store_true',
                     help='do not normalize text before computing hash')
+    ap.add_argument('-M', '--manifest', metavar='FILE', default=None,
+                    help='record completed inputs in FILE and skip inputs '
+                    'completed with the same options in earlier runs')
+    ap.add_argument('--scan-cache', metavar='FILE', default=None,
+                    help='cache list of files found in directories in FILE')
     ap.add_argument('-v', '--verbose', default=False, action='store_true')
     ap.add_argument('-q', '--quiet', default=False, action='store_true')
+    add_payload_cap_arguments(ap, OVERSIZE_ACTIONS + ('hash',))
+    add_telemetry_arguments(ap)
+    add_memory_profile_arguments(ap)
     return ap
 
 
@@ -130,6 +151,7 @@ def normalize_space(text):
 
 
 def extract_text_from_html(id_, uri, mime_type, content, args):
+    from bs4 import BeautifulSoup    # deferred, slow to import
     soup = BeautifulSoup(content, features='html.parser') #features='lxml')
 
     # drop script and style elements (TODO: is this necessary?)
@@ -163,6 +185,7 @@ def write_stats(stats, label, out=sys.stderr):
         f'{stats["errors"]} errors',
         file=out
     )
+    write_cap_stats(stats, label, out)
 
 
 def clean_text(text):
@@ -197,7 +220,15 @@ def compute_hash(text):
     return base64.b64encode(hash_.to_bytes(16, 'big')).decode()
 
 
+def compute_payload_hash(record):
+    # Hash of the payload streamed in chunks for payloads too large to
+    # extract text from. This is not a hash of the normalized text, so
+    # it only matches exact copies of the payload.
+    return base64.b64encode(hash_payload(record)).decode()
+
+
 def compute_hashes_stream(stream, stats, args):
+    profiler = get_profiler(args)
     for record in ArchiveIterator(stream):
         stats['total'] += 1
 
@@ -216,7 +247,21 @@ def compute_hashes_stream(stream, stats, args):
 
         uri = get_target_uri(record)
         type_ = get_mime_type(record)
-        content = record.content_stream().read()
+        if profiler is not None:
+            profiler.begin(id_, record.length)
+
+        if args.oversize == 'hash' and is_oversize(record, args.max_payload):
+            if is_unsupported_mime_type(type_):
+                logging.error(f'unsupported payload type: {type_}')
+                stats['unsupported'] += 1
+                continue
+            print(f'{id_}\t{compute_payload_hash(record)}')
+            stats[OVERSIZE_STATS['hash']] += 1
+            continue
+
+        content = read_capped_payload(record, stats, args)
+        if content is None:
+            continue
 
         if not content:
             logging.warning(f'empty content: {id_}')
@@ -237,6 +282,8 @@ def compute_hashes_stream(stream, stats, args):
 
         text_content = clean_text(text_content)
         text_content = normalize_text(text_content, args)
+        if profiler is not None:
+            profiler.end()
 
         if not text_content:
             logging.info(f'empty text content: {id_}')
@@ -265,10 +312,12 @@ def compute_hashes_stream(stream, stats, args):
 def compute_hashes(fn, stats, args):
     if not fn.endswith('.gz'):
         with open(fn, 'rb') as f:
-            compute_hashes_stream(f, stats, args)
+            with track_progress(f, fn, stats, args) as f:
+                compute_hashes_stream(f, stats, args)
     else:
         with gzip.open(fn) as f:
-            compute_hashes_stream(f, stats, args)
+            with track_progress(f, fn, stats, args) as f:
+                compute_hashes_stream(f, stats, args)
 
 
 def configure_logging(args):
@@ -285,19 +334,24 @@ def main(argv):
     configure_logging(args)
 
     stats = defaultdict(int)
-    for fn in args.input:
-        if os.path.isfile(fn):
-            compute_hashes(fn, stats, args)
-        else:
-            paths = glob(f'{fn}/**/*.warc.gz', recursive=True)
-            for p in sorted(paths):
-                try:
+    with open_manifest(args.manifest, __file__, args) as manifest:
+        for p in iter_paths(args.input, args.scan_cache):
+            if manifest.is_done(p):
+                logging.info(f'skipping {p} completed in manifest')
+                stats['completed inputs'] += 1
+                continue
+            try:
+                with manifest.track(p):
                     compute_hashes(p, stats, args)
-                except Exception as e:
-                    logging.error(f'failed to convert {p}: {e}')
-                    raise
+            except Exception as e:
+                logging.error(f'failed to convert {p}: {e}')
+                raise
 
     write_stats(stats, 'DONE.')
+    write_memory_profile(get_profiler(args))
+    if stats['completed inputs']:
+        print(f'skipped {stats["completed inputs"]} inputs completed in '
+              f'{args.manifest}', file=sys.stderr)
 
 
 if __name__ == '__main__':
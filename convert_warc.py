@@ -6,26 +6,34 @@
 # TODO resolve overlap with other scripts
 
 import sys
-import os
 import re
 import gzip
 import json
 import random
 import logging
 
-import zstandard as zstd
-import trafilatura
-import justext
-import inscriptis
-
 from collections import defaultdict
-from glob import glob
 from argparse import ArgumentParser
 
 from warcio.archiveiterator import ArchiveIterator
-from bs4 import BeautifulSoup
-from goose3 import Goose
-from w3lib.encoding import html_to_unicode
+
+from common import set_trafilatura_loglevel
+from manifest import open_manifest
+from telemetry import add_telemetry_arguments, track_progress
+from memprofile import (
+    add_memory_profile_arguments,
+    get_profiler,
+    write_memory_profile,
+)
+from payload_cap import (
+    add_payload_cap_arguments,
+    read_capped_payload,
+    write_cap_stats,
+)
+from warc_files import iter_paths
+
+# Extractor libraries and zstandard are slow to import and only needed
+# for specific options, so they are imported on first use below.
 
 # workaround for high recursion in str(soup)
 sys.setrecursionlimit(10000)
@@ -77,6 +85,20 @@ _EXTRACTORS = [
     'inscriptis',
 ]
 
+# Default extractors for --extractor cascade, cheapest first
+DEFAULT_CASCADE = 'inscriptis,trafilatura'
+
+# Lines with fewer words are considered "short" by cascade quality checks
+_SHORT_LINE_WORDS = 3
+
+# Anchor elements and tags for link density estimation. Anchor text
+# can't contain another <a> or </a> tag, so that a match attempt stops
+# at the next anchor instead of scanning the rest of the page when an
+# <a> is not closed (quadratic in pages with many unclosed anchors).
+_ANCHOR_RE = re.compile(rb'<a\b[^>]*>([^<]*(?:<(?!/?a\b)[^<]*)*)</a\s*>',
+                        re.IGNORECASE)
+_TAG_RE = re.compile(rb'<[^>]*>')
+
 
 # HTML inline elements
 # (from https://developer.mozilla.org/en-US/docs/Web/HTML/Inline_elements)
@@ -143,7 +165,18 @@ def argparser():
     ap = ArgumentParser()
     ap.add_argument('input', nargs='+', metavar='FILE-OR-DIR')
     ap.add_argument('-e', '--extractor', default='trafilatura',
-                    choices=_EXTRACTORS + ['random'])
+                    choices=_EXTRACTORS + ['random', 'cascade'])
+    ap.add_argument('--cascade', metavar='EXTRACTOR[,EXTRACTOR...]',
+                    default=DEFAULT_CASCADE,
+                    help='extractors to try with "-e cascade", cheapest first')
+    ap.add_argument('--cascade-min-chars', metavar='N', type=int, default=200,
+                    help='fall back if extracted text is shorter than N')
+    ap.add_argument('--cascade-max-link-density', metavar='X', type=float,
+                    default=0.5,
+                    help='fall back if ratio of link text to text is above X')
+    ap.add_argument('--cascade-max-short-lines', metavar='X', type=float,
+                    default=0.5,
+                    help='fall back if ratio of short lines is above X')
     ap.add_argument('-H', '--html', default=False, action='store_true',
                     help='output HTML instead of extracted text')
     ap.add_argument('-r', '--refers-to', default=False, action='store_true',
@@ -152,8 +185,16 @@ def argparser():
                     help='sample given ratio of responses')
     ap.add_argument('-t', '--text-only', default=False, action='store_true',
                     help='output plain text instead of JSONL')
+    ap.add_argument('-M', '--manifest', metavar='FILE', default=None,
+                    help='record completed inputs in FILE and skip inputs '
+                    'completed with the same options in earlier runs')
+    ap.add_argument('--scan-cache', metavar='FILE', default=None,
+                    help='cache list of files found in directories in FILE')
     ap.add_argument('-v', '--verbose', default=False, action='store_true')
     ap.add_argument('-q', '--quiet', default=False, action='store_true')
+    add_payload_cap_arguments(ap)
+    add_telemetry_arguments(ap)
+    add_memory_profile_arguments(ap)
     return ap
 
 
@@ -215,12 +256,14 @@ def get_mime_type(record):
 
 
 def justext_extract(content):
+    import justext
     paragraphs = justext.justext(content, justext.get_stoplist("Finnish"))
     paragraphs = [p for p in paragraphs if not p.is_boilerplate]
     return '\n\n'.join(p.text for p in paragraphs)
 
 
 def trafilatura_extract(content, uri, args):
+    import trafilatura
     options = {
         #'include_tables': False,
         #'favor_precision': True,
@@ -240,6 +283,7 @@ def normalize_space(text):
 
 
 def beautifulsoup_extract(content, parser='html.parser'):
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(content, features=parser)
     
     # drop script and style elements (TODO: unnecessary for get_text)
@@ -268,6 +312,8 @@ def beautifulsoup_extract(content, parser='html.parser'):
 
 
 def inscriptis_extract(content):
+    import inscriptis
+    from w3lib.encoding import html_to_unicode
     content = html_to_unicode(None, content)[1]    # TODO pass header
     #content = UnicodeDammit(content).unicode_markup    # alternative
     text = inscriptis.get_text(content)
@@ -275,13 +321,26 @@ def inscriptis_extract(content):
     return text
 
 
+# Goose instance, created on first use and reused across records
+_goose = None
+
+
+def get_goose():
+    global _goose
+    if _goose is None:
+        from goose3 import Goose
+        _goose = Goose()
+    return _goose
+
+
 def goose3_extract(content):
-    g = Goose()
+    g = get_goose()
     a = g.extract(raw_html=content)
     return a.cleaned_text
 
 
 def pretty_html(content, parser='html.parser'):
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(content, features=parser)
 
     # drop script and style elements
@@ -291,15 +350,7 @@ def pretty_html(content, parser='html.parser'):
     return soup.prettify()
 
 
-def extract_text_from_html(id_, uri, mime_type, content, args):
-    if args.html:
-        return pretty_html(content)
-
-    if args.extractor == 'random':
-        extractor = random.choice(_EXTRACTORS)
-    else:
-        extractor = args.extractor
-
+def run_extractor(extractor, content, uri, args):
     if extractor == 'trafilatura':
         return trafilatura_extract(content, uri, args)
     elif extractor == 'justext':
@@ -314,15 +365,72 @@ def extract_text_from_html(id_, uri, mime_type, content, args):
         raise ValueError(extractor)
 
 
-def get_text_content(id_, uri, mime_type, content, args):
+def link_density(text, content):
+    link_chars = 0
+    for m in _ANCHOR_RE.finditer(content):
+        anchor_text = _TAG_RE.sub(b'', m.group(1)).strip()
+        link_chars += len(anchor_text.decode('utf-8', 'replace'))
+    return min(1.0, link_chars / len(text))
+
+
+def cascade_rejection_reason(text, content, args):
+    # Quick checks for poor extraction results, returns None if OK
+    if not text or len(text) < args.cascade_min_chars:
+        return 'too short'
+    if link_density(text, content) > args.cascade_max_link_density:
+        return 'link density'
+    lines = [line for line in text.split('\n') if line and not line.isspace()]
+    short = sum(1 for line in lines if len(line.split()) < _SHORT_LINE_WORDS)
+    if not lines or short / len(lines) > args.cascade_max_short_lines:
+        return 'short lines'
+    return None
+
+
+def cascade_extract(id_, uri, content, stats, args):
+    for i, extractor in enumerate(args.cascade, start=1):
+        try:
+            text = run_extractor(extractor, content, uri, args)
+        except Exception as e:
+            if i == len(args.cascade):
+                raise
+            logging.info(f'{extractor} failed for {id_}, falling back: {e}')
+            reason = 'error'
+        else:
+            if i == len(args.cascade):
+                reason = None    # last resort, accept whatever we got
+            else:
+                reason = cascade_rejection_reason(text, content, args)
+        if reason is None:
+            stats[f'cascade {extractor}'] += 1
+            return text
+        stats[f'cascade rejected {extractor} ({reason})'] += 1
+
+
+def extract_text_from_html(id_, uri, mime_type, content, stats, args):
+    if args.html:
+        return pretty_html(content)
+
+    if args.extractor == 'random':
+        extractor = random.choice(_EXTRACTORS)
+    elif args.extractor == 'cascade':
+        return cascade_extract(id_, uri, content, stats, args)
+    else:
+        extractor = args.extractor
+
+    return run_extractor(extractor, content, uri, args)
+
+
+def get_text_content(id_, uri, mime_type, content, stats, args):
     if is_plain_text_mime_type(mime_type):
         return content.decode('utf-8')
     elif is_html_like_mime_type(mime_type):
-        return extract_text_from_html(id_, uri, mime_type, content, args)
+        return extract_text_from_html(id_, uri, mime_type, content, stats,
+                                      args)
     else:
         logging.error(f'unexpected MIME type {mime_type} for {id_}')
         # try anyway
-        return extract_text_from_html(id_, uri, mime_type, content, args)
+        return extract_text_from_html(id_, uri, mime_type, content, stats,
+                                      args)
 
 
 def write_stats(stats, label, out=sys.stderr):
@@ -337,6 +445,15 @@ def write_stats(stats, label, out=sys.stderr):
         f'{stats["errors"]} errors',
         file=out
     )
+    cascade = [(k, v) for k, v in stats.items() if k.startswith('cascade ')]
+    if cascade:
+        total = sum(v for k, v in cascade if not k.startswith('cascade rej'))
+        print(
+            f'{label}',
+            ', '.join(f'{k} {v} ({v/max(total, 1):.1%})' for k, v in cascade),
+            file=out
+        )
+    write_cap_stats(stats, label, out)
 
 
 def clean_text(text):
@@ -352,6 +469,7 @@ def clean_id(id_):
 
 
 def convert_warc_stream(stream, stats, args):
+    profiler = get_profiler(args)
     for record in ArchiveIterator(stream):
         stats['total'] += 1
 
@@ -376,7 +494,11 @@ def convert_warc_stream(stream, stats, args):
         type_ = get_mime_type(record)
         date = get_record_date(record)
         length = get_content_length(record)
-        content = record.content_stream().read()
+        if profiler is not None:
+            profiler.begin(id_, length)
+        content = read_capped_payload(record, stats, args)
+        if content is None:
+            continue
 
         if not content:
             logging.warning(f'empty content: {id_}')
@@ -389,13 +511,16 @@ def convert_warc_stream(stream, stats, args):
             continue
 
         try:
-            text_content = get_text_content(id_, uri, type_, content, args)
+            text_content = get_text_content(id_, uri, type_, content, stats,
+                                            args)
         except Exception as e:
             logging.error(f'failed extract for {id_}: {e}')
             stats['errors'] += 1
             continue
 
         text_content = clean_text(text_content)
+        if profiler is not None:
+            profiler.end()
 
         if not text_content:
             logging.info(f'empty text content: {id_}')
@@ -432,22 +557,18 @@ def convert_warc_stream(stream, stats, args):
 def convert_warc(fn, stats, args):
     if fn.endswith('.gz'):
         with gzip.open(fn) as f:
-            convert_warc_stream(f, stats, args)
+            with track_progress(f, fn, stats, args) as f:
+                convert_warc_stream(f, stats, args)
     elif fn.endswith('.zst'):
+        import zstandard as zstd
         dctx = zstd.ZstdDecompressor(max_window_size=2**31)
         with zstd.open(fn, 'rb', dctx=dctx) as f:
-            convert_warc_stream(f, stats, args)
+            with track_progress(f, fn, stats, args) as f:
+                convert_warc_stream(f, stats, args)
     else:
         with open(fn, 'rb') as f:
-            convert_warc_stream(f, stats, args)
-
-
-def set_trafilatura_loglevel(level):
-    try:
-        trafilatura.core.LOGGER.setLevel(level)
-        trafilatura.utils.LOGGER.setLevel(level)
-    except:
-        logging.warning('Failed to set trafilatura log level')
+            with track_progress(f, fn, stats, args) as f:
+                convert_warc_stream(f, stats, args)
 
 
 def configure_logging(args):
@@ -462,25 +583,39 @@ def configure_logging(args):
         set_trafilatura_loglevel(logging.ERROR)
 
 
+def prepare_args(args):
+    # Post-parse setup of arguments, shared with warc_worker.py
+    args.cascade = args.cascade.split(',')
+    for extractor in args.cascade:
+        if extractor not in _EXTRACTORS:
+            argparser().error(f'unknown extractor in --cascade: {extractor}')
+    return args
+
+
 def main(argv):
-    args = argparser().parse_args(argv[1:])
+    args = prepare_args(argparser().parse_args(argv[1:]))
 
     configure_logging(args)
 
     stats = defaultdict(int)
-    for fn in args.input:
-        if os.path.isfile(fn):
-            convert_warc(fn, stats, args)
-        else:
-            paths = glob(f'{fn}/**/*.warc.gz', recursive=True)
-            for p in sorted(paths):
-                try:
+    with open_manifest(args.manifest, __file__, args) as manifest:
+        for p in iter_paths(args.input, args.scan_cache):
+            if manifest.is_done(p):
+                logging.info(f'skipping {p} completed in manifest')
+                stats['completed inputs'] += 1
+                continue
+            try:
+                with manifest.track(p):
                     convert_warc(p, stats, args)
-                except Exception as e:
-                    logging.error(f'failed to convert {p}: {e}')
-                    raise
+            except Exception as e:
+                logging.error(f'failed to convert {p}: {e}')
+                raise
 
     write_stats(stats, 'DONE.')
+    write_memory_profile(get_profiler(args))
+    if stats['completed inputs']:
+        print(f'skipped {stats["completed inputs"]} inputs completed in '
+              f'{args.manifest}', file=sys.stderr)
 
 
 if __name__ == '__main__':
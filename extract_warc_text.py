@@ -7,8 +7,7 @@ import gzip
 import json
 import logging
 
-import trafilatura
-
+from collections import defaultdict
 from argparse import ArgumentParser
 
 from warcio.archiveiterator import ArchiveIterator
@@ -20,7 +19,14 @@ from common import (
     get_text_content,
     is_html_like_mime_type,
     is_unsupported_mime_type,
+    set_trafilatura_loglevel,
+)
+from payload_cap import (
+    add_payload_cap_arguments,
+    read_capped_payload,
+    write_cap_stats,
 )
+from telemetry import add_telemetry_arguments, track_progress
 
 def argparser():
     ap = ArgumentParser()
@@ -33,13 +39,15 @@ def argparser():
                     help='Output XML')
     ap.add_argument('-v', '--verbose', default=False, action='store_true')
     ap.add_argument('-q', '--quiet', default=False, action='store_true')
+    add_payload_cap_arguments(ap)
+    add_telemetry_arguments(ap)
     return ap
 
 
-def process_stream(flo, options):
-    responses, skipped, total, empties, errors, unsupported = 0, 0, 0, 0, 0, 0
+def process_stream(flo, stats, options):
+    responses, skipped, empties, errors, unsupported = 0, 0, 0, 0, 0
     for record in ArchiveIterator(flo):
-        total += 1
+        stats['total'] += 1
         if record.rec_type != 'response':
             continue
         responses += 1
@@ -48,7 +56,10 @@ def process_stream(flo, options):
         if options.ids is not None and not any(i in id_ for i in options.ids):
             skipped += 1
             continue
-        content = record.content_stream().read()
+        content = read_capped_payload(record, stats, options)
+        if content is None:
+            logging.info(f'payload over {options.max_payload} bytes: {id_}')
+            continue
         if not content:
             logging.warning(f'empty content: {id_}')
             empties += 1
@@ -94,20 +105,15 @@ def process_stream(flo, options):
             }
             print(json.dumps(data, sort_keys=True, ensure_ascii=False))
 
-        if total % 1000 == 0:
-            logging.info(f'processed {total} records, {responses} responses, '
-                         f'{empties} with empty text content, {errors} errors')
-
-    print(f'Done, processed {total} records, {responses} responses, '
-          f'{skipped} skipped, {empties} empty text content, {errors} errors',
-          file=sys.stderr)
-
+        if stats['total'] % 1000 == 0:
+            logging.info(f'processed {stats["total"]} records, {responses} '
+                         f'responses, {empties} with empty text content, '
+                         f'{errors} errors')
 
-def set_trafilatura_loglevel(level):
-    try:
-        trafilatura.core.LOGGER.setLevel(level)
-    except:
-        logging.warning('Failed to set trafilatura log level')
+    print(f'Done, processed {stats["total"]} records, {responses} responses, '
+          f'{skipped} skipped, {empties} empty text content, '
+          f'{errors} errors', file=sys.stderr)
+    write_cap_stats(stats, 'Done,')
 
 
 def main(argv):
@@ -126,13 +132,16 @@ def main(argv):
         set_trafilatura_loglevel(logging.ERROR)
 
     for fn in args.warc:
+        stats = defaultdict(int)
         try:
             if not fn.endswith('.gz'):
                 with open(fn, 'rb') as f:
-                    process_stream(f, args)
+                    with track_progress(f, fn, stats, args) as f:
+                        process_stream(f, stats, args)
             else:
                 with gzip.open(fn) as f:
-                    process_stream(f, args)
+                    with track_progress(f, fn, stats, args) as f:
+                        process_stream(f, stats, args)
         except Exception as e:
             logging.error(f'failed processing {fn}: {e}')
 
@@ -9,4 +9,7 @@ set -euo pipefail
 
 source venv/bin/activate
 
+# marker for plan_tasks.py --skip-existing, written only on success
+rm -f "$OUT.completed"
 python extract_warc_text.py -q "$IN" > "$OUT"
+date > "$OUT.completed"
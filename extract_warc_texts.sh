@@ -9,6 +9,9 @@ ACCOUNT=project_2004407    # FinnGen-data
 # Maximum number of GREASY steps to run
 MAX_STEPS=1 #200000
 
+# Target wall time of a step in seconds; files are packed into steps
+TASK_TIME=60
+
 set -euo pipefail
 
 if [ $# -ne 2 ]; then
@@ -38,27 +41,16 @@ mkdir -p "$PWD/tmp"
 TASKLIST=`mktemp -p $PWD/tmp tasklist.XXX`
 
 # Create tasklist
-count=0
-skip=0
-while read i; do
-    if [ $count -ge $MAX_STEPS ]; then
-	echo "MAX_STEPS ($MAX_STEPS) reached, skipping remaining" >&2
-	break
-    fi
-    o="$OUTDIR"/$(dirname ${i#$INDIR/})/$(basename $i .warc.gz).tsv
-    if [ -e "$o" ]; then
-	# echo "$o exists, skipping $i" >&2
-	skip=$((skip+1))
-	if [ $((skip % 1000)) -eq 0 ]; then
-	    echo "Skippped $skip ..." >&2
-	fi
-    else
-	echo "./extract_warc_text.sh $i $o"
-	count=$((count+1))
-    fi
-done < <(find "$INDIR" -name '*.warc.gz') > "$TASKLIST"
+python plan_tasks.py \
+    --output-dir "$OUTDIR" \
+    --output-suffix .tsv \
+    --skip-existing \
+    --task-time $TASK_TIME \
+    --max-tasks $MAX_STEPS \
+    "./extract_warc_text.sh {input} {output}" \
+    "$INDIR" > "$TASKLIST"
 
-echo "Wrote tasklist with $count tasks, skipped $skip." >&2
+count=$(wc -l < "$TASKLIST")
 if [ $count -eq 0 ]; then
     rm "$TASKLIST"
     echo "All done, exiting without tasklist." >&2
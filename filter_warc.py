@@ -1,18 +1,34 @@
 #!/usr/bin/env python3
 
 # Filter warc file to records with given WARC-Record-ID values.
+# With --route, write records to several outputs by label in one pass.
+# With --selection, read only the gzip members listed in a selection
+# from select_from_wat.py and copy them without recompression.
 
+import os
 import sys
 import gzip
 import logging
 
 from time import time
 from functools import wraps
+from contextlib import ExitStack
+from collections import defaultdict
 from argparse import ArgumentParser
 
-from warcio import WARCWriter
 from warcio.archiveiterator import ArchiveIterator
 
+from common import buffer_payload
+from warc_writer import open_warc_writer
+from telemetry import add_telemetry_arguments, track_members, track_progress
+from warc_members import mmap_file, read_member_record
+
+
+# Placeholder for label in output path with --route
+LABEL_PLACEHOLDER = '{label}'
+
+# Buffer size for output files with --route
+OUTPUT_BUFFER_SIZE = 2**20
 
 
 def argparser():
@@ -21,7 +37,17 @@ def argparser():
     ap.add_argument('warc_in')
     ap.add_argument('warc_out')
     ap.add_argument('-r', '--refers-to', default=False, action='store_true')
+    ap.add_argument('-R', '--route', default=False, action='store_true',
+                    help='route records to outputs by label: IDS is a TSV '
+                    'file with ID and label or a comma-separated list of '
+                    'LABEL=IDFILE, and WARC_OUT contains "{label}"')
+    ap.add_argument('-s', '--selection', default=False, action='store_true',
+                    help='IDS is a selection from select_from_wat.py; read '
+                    'only selected members (per-record gzip input)')
+    ap.add_argument('-t', '--compress-threads', metavar='N', type=int,
+                    default=0, help='compress output in N background threads')
     ap.add_argument('-v', '--verbose', default=False, action='store_true')
+    add_telemetry_arguments(ap)
     return ap
 
 
@@ -32,24 +58,77 @@ def get_id(record, args):
         return record.rec_headers.get_header('WARC-Refers-To')
 
 
-def filter_warc_stream(ids, warc_in, warc_out, args):
-    writer = WARCWriter(warc_out, gzip=True)
+def filter_warc_stream(ids, warc_in, warc_out, stats, args):
+    writer = open_warc_writer(warc_out, args.compress_threads)
+
+    output, errors = 0, 0
+    with writer:
+        for record in ArchiveIterator(warc_in):
+            id_ = get_id(record, args)
+            if id_ in ids:
+                output += 1
+                try:
+                    writer.write_record(record)
+                except Exception as e:
+                    logging.error(f'failed to write record: {e}')
+                    errors += 1
+            stats['total'] += 1
+            if stats['total'] % 10000 == 0:
+                logging.info(f'processed {stats["total"]} records, output '
+                             f'{output}, {errors} errors')
+    print(f'Done, processed {stats["total"]} records, output {output}, '
+          f'{errors} errors')
 
-    output, total, errors = 0, 0, 0
+
+def route_warc_stream(routes, warc_in, writers, stats, args):
+    counts = defaultdict(int)
+    errors = 0
     for record in ArchiveIterator(warc_in):
         id_ = get_id(record, args)
-        if id_ in ids:
-            output += 1
-            try:
-                writer.write_record(record)
-            except Exception as e:
-                logging.error(f'failed to write record: {e}')
-                errors += 1
-        total += 1
-        if total % 10000 == 0:
-            logging.info(f'processed {total} records, output {output}, '
-                         f'{errors} errors')
-    print(f'Done, processed {total} records, output {output}, '
+        labels = routes.get(id_)
+        if labels:
+            if len(labels) > 1:
+                record = buffer_payload(record)    # write more than once
+            for label in labels:
+                if len(labels) > 1:
+                    record.raw_stream.seek(0)
+                try:
+                    writers[label].write_record(record)
+                    counts[label] += 1
+                except Exception as e:
+                    logging.error(f'failed to write record to {label}: {e}')
+                    errors += 1
+        stats['total'] += 1
+        if stats['total'] % 10000 == 0:
+            logging.info(f'processed {stats["total"]} records, output '
+                         f'{sum(counts.values())}, {errors} errors')
+    print(f'Done, processed {stats["total"]} records, output '
+          f'{sum(counts.values())}, {errors} errors')
+    for label in sorted(writers):
+        print(f'{label}\t{counts[label]}')
+
+
+def filter_warc_selection(selection, warc_in, warc_out, stats, progress,
+                          args):
+    output, errors = 0, 0
+    for offset, id_ in selection:
+        stats['total'] += 1
+        try:
+            record = read_member_record(warc_in, offset)
+        except ValueError as e:
+            logging.error(f'failed to read selected record {id_}: {e}')
+            errors += 1
+            continue
+        if get_id(record, args) != id_:
+            logging.error(f'expected {id_} at offset {offset}, got '
+                          f'{get_id(record, args)}')
+            errors += 1
+            continue
+        warc_out.write(warc_in[offset:offset+record.length])
+        output += 1
+        if progress is not None:
+            progress.update(compressed=offset+record.length)
+    print(f'Done, read {len(selection)} selected records, output {output}, '
           f'{errors} errors')
 
 
@@ -80,6 +159,37 @@ def load_response_ids(fn):
     return ids
 
 
+@timed
+def load_routes(spec):
+    # Returns dict mapping ID to list of distinct labels
+    routes = defaultdict(list)
+
+    def add_route(id_, label):
+        # repeated ID-label pairs would write the record more than once
+        if label not in routes[id_]:
+            routes[id_].append(label)
+
+    if '=' not in spec:
+        # TSV file with ID and label
+        fn = spec
+        xopen = open if not fn.endswith('.gz') else gzip.open
+        with xopen(fn, mode='rt', encoding='utf-8') as route_in:
+            for ln, l in enumerate(route_in, start=1):
+                try:
+                    id_, label = l.rstrip('\n').split('\t')
+                except ValueError:
+                    raise ValueError(f'expected ID<TAB>LABEL on line {ln} in '
+                                     f'{fn}: {l}')
+                add_route(id_, label)
+    else:
+        # ID list per label
+        for item in spec.split(','):
+            label, fn = item.split('=', 1)
+            for id_ in load_response_ids(fn):
+                add_route(id_, label)
+    return routes
+
+
 def main(argv):
     args = argparser().parse_args(argv[1:])
 
@@ -87,11 +197,54 @@ def main(argv):
     if args.verbose:
         logging.getLogger().setLevel(logging.INFO)
 
+    if args.route:
+        return route_main(args)
+    elif args.selection:
+        return selection_main(args)
+
     ids = load_response_ids(args.ids)
 
+    stats = defaultdict(int)
     with gzip.open(args.warc_in) as warc_in:
+        with track_progress(warc_in, args.warc_in, stats, args) as warc_in:
+            with open(args.warc_out, 'wb') as warc_out:
+                filter_warc_stream(ids, warc_in, warc_out, stats, args)
+
+
+def selection_main(args):
+    from select_from_wat import load_selection
+    selection = timed(load_selection)(args.ids, args.warc_in)
+
+    stats = defaultdict(int)
+    with mmap_file(args.warc_in) as warc_in:
         with open(args.warc_out, 'wb') as warc_out:
-            filter_warc_stream(ids, warc_in, warc_out, args)
+            with track_members(args.warc_in, stats, args) as progress:
+                filter_warc_selection(selection, warc_in, warc_out, stats,
+                                      progress, args)
+
+
+def route_main(args):
+    if LABEL_PLACEHOLDER not in args.warc_out:
+        raise ValueError(f'output must contain {LABEL_PLACEHOLDER} with '
+                         f'--route: {args.warc_out}')
+
+    routes = load_routes(args.ids)
+    labels = sorted(set(l for labels in routes.values() for l in labels))
+
+    stats = defaultdict(int)
+    with ExitStack() as stack:
+        writers = {}
+        for label in labels:
+            fn = args.warc_out.replace(LABEL_PLACEHOLDER, label)
+            os.makedirs(os.path.dirname(fn) or '.', exist_ok=True)
+            f = stack.enter_context(open(fn, 'wb',
+                                         buffering=OUTPUT_BUFFER_SIZE))
+            writers[label] = stack.enter_context(
+                open_warc_writer(f, args.compress_threads))
+        warc_in = stack.enter_context(gzip.open(args.warc_in))
+        warc_in = stack.enter_context(
+            track_progress(warc_in, args.warc_in, stats, args))
+        route_warc_stream(routes, warc_in, writers, stats, args)
 
 
 if __name__ == '__main__':
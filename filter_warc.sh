@@ -4,4 +4,9 @@ set -euo pipefail
 
 source venv/bin/activate
 
+# marker for filter_warcs.sh on the output (last argument), written
+# only on success
+OUT="${@: -1}"
+rm -f "$OUT.completed"
 python filter_warc.py "$@"
+date > "$OUT.completed"
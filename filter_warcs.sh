@@ -63,8 +63,8 @@ find "$INDIR" -name '*.warc.gz' | while read i; do
 	break
     fi
     o="$OUTDIR"/$(dirname ${i#$INDIR/})/$(basename $i)
-    if [ -e "$o" ]; then
-	# echo "$o exists, skipping $i" >&2
+    if [ -e "$o.completed" ]; then
+	# echo "$o completed, skipping $i" >&2
 	skip=$((skip+1))
     else
 	echo "./filter_warc.sh $IDS $i $o"
@@ -73,7 +73,7 @@ find "$INDIR" -name '*.warc.gz' | while read i; do
 done > $TASKLIST
 set -e
 if [ $skip -gt 0 ]; then
-    echo "skipped $skip files with existing outputs." >&2
+    echo "skipped $skip files with completed outputs." >&2
 fi
 
 sbatch-greasy $TASKLIST \
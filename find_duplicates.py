@@ -9,15 +9,26 @@ import logging
 
 import mmh3
 
+from collections import defaultdict
 from argparse import ArgumentParser
 
 from warcio.archiveiterator import ArchiveIterator
 
 from common import (
+    get_payload_type,
     get_record_id,
     get_record_text_content,
+    hash_payload,
+    is_oversize,
+    is_unsupported_mime_type,
     set_trafilatura_loglevel,
 )
+from payload_cap import (
+    OVERSIZE_ACTIONS,
+    OVERSIZE_STATS,
+    add_payload_cap_arguments,
+    write_cap_stats,
+)
 
 
 def argparser():
@@ -25,18 +36,46 @@ def argparser():
     ap.add_argument('warc', nargs='+')
     ap.add_argument('--db', default='response-hashes.db')
     ap.add_argument('-v', '--verbose', default=False, action='store_true')
+    add_payload_cap_arguments(ap, OVERSIZE_ACTIONS + ('hash',))
     return ap
 
 
-def find_duplicates(db, warc, options):
+def get_record_hash(record, stats, options):
+    # Hash of the text content, or None if the record is skipped. With
+    # "--oversize hash", payloads over --max-payload are hashed in chunks
+    # instead, so that only exact copies of them are found. Payload
+    # hashes are a separate hash space from text hashes: an oversized
+    # record never matches a record whose text was hashed, even if the
+    # text is the same.
+    if (record.rec_type == 'response' and
+        is_oversize(record, options.max_payload)):
+        if options.oversize == 'hash':
+            # only types that text would be extracted from, as in
+            # compute_warc_hashes.py
+            mime_type = get_payload_type(record)
+            if is_unsupported_mime_type(mime_type):
+                raise ValueError(f'unsupported mime type {mime_type} for '
+                                 f'{get_record_id(record)}')
+            stats[OVERSIZE_STATS['hash']] += 1
+            return hash_payload(record)
+        stats[OVERSIZE_STATS[options.oversize]] += 1
+        if options.oversize == 'skip':
+            return None
+    text = get_record_text_content(record, max_payload=options.max_payload,
+                                   truncate=options.oversize == 'truncate')
+    return mmh3.hash_bytes(text)
+
+
+def find_duplicates(db, warc, stats, options):
     for record in ArchiveIterator(warc):
         id_ = get_record_id(record)
         try:
-            text = get_record_text_content(record)
+            text_hash = get_record_hash(record, stats, options)
         except ValueError as e:
             logging.error(e)
             continue
-        text_hash = mmh3.hash_bytes(text)
+        if text_hash is None:
+            continue
         seen = db.get(text_hash, None)
         byte_id = id_.encode('utf-8')
         if seen is None:
@@ -61,11 +100,13 @@ def main(argv):
     db = dbm.open(args.db, 'c')
     logging.info(f'opened {type(dbm).__name__} db {args.db}')
 
+    stats = defaultdict(int)
     for fn in args.warc:
         with gzip.open(fn) as warc:
-            find_duplicates(db, warc, args)
+            find_duplicates(db, warc, stats, args)
 
     db.close()
+    write_cap_stats(stats, 'find_duplicates.py:')
 
 
 if __name__ == '__main__':
@@ -5,24 +5,40 @@ import os
 import re
 import gzip
 import logging
+import multiprocessing
 
-import fasttext
+from io import StringIO
+from functools import partial
+from contextlib import redirect_stdout
 
-from collections import defaultdict
-from glob import glob
+from collections import defaultdict, Counter
 from argparse import ArgumentParser
 
 from warcio.archiveiterator import ArchiveIterator
-from bs4 import BeautifulSoup
 
 from common import (
     get_record_id,
     get_target_uri,
     get_mime_type,
+    get_memory_usage,
     is_plain_text_mime_type,
     is_html_like_mime_type,
     is_unsupported_mime_type,
+    replace_unicode_errors,
 )
+from manifest import open_manifest
+from telemetry import add_telemetry_arguments, track_progress
+from memprofile import (
+    add_memory_profile_arguments,
+    get_profiler,
+    write_memory_profile,
+)
+from payload_cap import (
+    add_payload_cap_arguments,
+    read_capped_payload,
+    write_cap_stats,
+)
+from warc_files import iter_paths
 
 # workaround for high recursion in str(soup)
 sys.setrecursionlimit(10000)
@@ -33,6 +49,9 @@ DEFAULT_WORD_RE = r'\b[^\W\d_]{2,}\b'
 # Prefix for fasttext labels
 LABEL_PREFIX = '__label__'
 
+# Model shared with forked worker processes, see langdetect_warcs_parallel()
+_shared_model = None
+
 # HTML inline elements
 # (from https://developer.mozilla.org/en-US/docs/Web/HTML/Inline_elements)
 _INLINE_ELEMENTS = [
@@ -110,11 +129,32 @@ def argparser():
                     help='minimum number of words to predict language on')
     ap.add_argument('--threshold', type=float, default=0.999,
                     help='threshold for predicting target language')
+    ap.add_argument('--prescreen', default=False, action='store_true',
+                    help='predict on whole document first, by line only if '
+                    'the prediction is not decisive')
+    ap.add_argument('--prescreen-threshold', metavar='X', type=float,
+                    default=0.99,
+                    help='threshold for decisive whole document prediction')
+    ap.add_argument('--prescreen-lines', metavar='N', type=int, default=0,
+                    help='prescreen on sample of N lines (0 for all lines)')
+    ap.add_argument('--distribution', metavar='K', type=int, default=0,
+                    help='also output word counts of the top K labels')
     ap.add_argument('--invert', default=False, action='store_true')
     ap.add_argument('--word-regex', default=DEFAULT_WORD_RE,
                     help='regular expression defining "word" for --min-words')
-    ap.add_argument('model', help='FastText model')
+    ap.add_argument('-j', '--processes', metavar='N', type=int, default=1,
+                    help='process files in N processes sharing one model')
+    ap.add_argument('-M', '--manifest', metavar='FILE', default=None,
+                    help='record completed inputs in FILE and skip inputs '
+                    'completed with the same options in earlier runs')
+    ap.add_argument('--scan-cache', metavar='FILE', default=None,
+                    help='cache list of files found in directories in FILE')
+    ap.add_argument('model',
+                    help='FastText model (quantized .ftz uses less memory)')
     ap.add_argument('input', nargs='+', metavar='FILE-OR-DIR')
+    add_payload_cap_arguments(ap)
+    add_telemetry_arguments(ap)
+    add_memory_profile_arguments(ap)
     return ap
 
 
@@ -133,6 +173,7 @@ def normalize_space(text):
 
 
 def beautifulsoup_extract(content, parser='html.parser'):
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(content, features=parser)
     
     # drop script and style elements (TODO: unnecessary for get_text)
@@ -186,6 +227,15 @@ def write_stats(stats, label, out=sys.stderr):
         f'{stats["errors"]} errors',
         file=out
     )
+    if any(k.startswith('prescreen ') for k in stats):
+        print(
+            f'{label}',
+            f'prescreen: {stats["prescreen target"]} target language,',
+            f'{stats["prescreen other"]} other language,',
+            f'{stats["prescreen uncertain"]} uncertain',
+            file=out
+        )
+    write_cap_stats(stats, label, out)
 
 
 def clean_text(text):
@@ -200,26 +250,63 @@ def clean_id(id_):
     return id_[1:-1]
 
 
-def replace_unicode_errors(string):
-    return string.encode('utf-8', 'replace').decode('utf-8')
-
-
-def target_label_probability(text, model, args):
-    target_label = LABEL_PREFIX + args.label
+def label_probabilities(text, model, args):
     try:
         labels, probs = model.predict([text], k=args.max_labels)
     except:
         text = replace_unicode_errors(text)
         labels, probs = model.predict([text], k=args.max_labels)
-    for label, prob in zip(labels[0], probs[0]):
-        if label == target_label:
-            return max(0.0, min(1.0, prob))
-    return 0.0    # target label not found
+    return [
+        (label[len(LABEL_PREFIX):], max(0.0, min(1.0, prob)))
+        for label, prob in zip(labels[0], probs[0])
+    ]
+
+
+def top_label_probability(text, model, args):
+    try:
+        labels, probs = model.predict([text], k=1)
+    except:
+        text = replace_unicode_errors(text)
+        labels, probs = model.predict([text], k=1)
+    label = labels[0][0][len(LABEL_PREFIX):]
+    return label, max(0.0, min(1.0, probs[0][0]))
+
+
+def langid_prescreen(text, model, stats, args):
+    # Predict on the whole document (or a sample of its lines) and
+    # return (label_words, total_words) as langid_by_line() if the
+    # prediction is decisive, None otherwise.
+    lines = [line.strip() for line in text.split('\n')]
+    lines = [line for line in lines if line and not line.isspace()]
+    word_counts = [len(args.word_regex.findall(line)) for line in lines]
+
+    if args.prescreen_lines and len(lines) > args.prescreen_lines:
+        step = len(lines) / args.prescreen_lines
+        lines = [lines[int(i*step)] for i in range(args.prescreen_lines)]
+
+    label, prob = top_label_probability(' '.join(lines), model, args)
+
+    if prob < args.prescreen_threshold:
+        stats['prescreen uncertain'] += 1
+        return None
+
+    if label == args.label:
+        stats['prescreen target'] += 1
+    else:
+        stats['prescreen other'] += 1
+
+    # count words as langid_by_line() would if all lines were predicted
+    # to be in the document language
+    n = args.min_pred_words
+    label_words = Counter({label: sum(c for c in word_counts if c >= n)})
+    return label_words, sum(word_counts)
 
 
 def langid_by_line(text, model, args):
+    # Returns number of words in lines predicted for each label with
+    # probability >= threshold and the total number of words
     lines = text.split('\n')
-    total_words, target_language_words = 0, 0
+    total_words, label_words = 0, Counter()
     for line in lines:
         line = line.strip()
 
@@ -232,12 +319,28 @@ def langid_by_line(text, model, args):
         if word_count < args.min_pred_words:
             continue    # too few words to predict
 
-        prob = target_label_probability(line, model, args)
+        for label, prob in label_probabilities(line, model, args):
+            if prob >= args.threshold:
+                label_words[label] += word_count
 
-        if prob >= args.threshold:
-            target_language_words += word_count
+    return label_words, total_words
 
-    return target_language_words, total_words
+
+def format_distribution(label_words, top_k):
+    # Compact "label:words" representation of the top_k labels
+    return ','.join(
+        f'{label}:{count}' for label, count in label_words.most_common(top_k)
+        if count > 0
+    )
+
+
+def parse_distribution(string):
+    label_words = Counter()
+    for item in string.split(','):
+        if item:
+            label, count = item.rsplit(':', 1)
+            label_words[label] = int(count)
+    return label_words
 
 
 def keep_text(target_language_words, total_words, args):
@@ -259,6 +362,7 @@ def keep_text(target_language_words, total_words, args):
 
 
 def langdetect_warc_stream(stream, model, stats, args):
+    profiler = get_profiler(args)
     for record in ArchiveIterator(stream):
         stats['total'] += 1
 
@@ -274,7 +378,11 @@ def langdetect_warc_stream(stream, model, stats, args):
 
         uri = get_target_uri(record)
         type_ = get_mime_type(record)
-        content = record.content_stream().read()
+        if profiler is not None:
+            profiler.begin(id_, record.length)
+        content = read_capped_payload(record, stats, args)
+        if content is None:
+            continue
 
         if not content:
             logging.warning(f'empty content: {id_}')
@@ -300,10 +408,23 @@ def langdetect_warc_stream(stream, model, stats, args):
             stats['empties'] += 1
             continue
 
-        target_language_words, total_words = langid_by_line(text, model, args)
+        result = None
+        if args.prescreen:
+            result = langid_prescreen(text, model, stats, args)
+        if result is None:
+            result = langid_by_line(text, model, args)
+        label_words, total_words = result
+        target_language_words = label_words[args.label]
+        if profiler is not None:
+            profiler.end()
         keep = keep_text(target_language_words, total_words, args)
 
-        print(f'{id_}\t{target_language_words}\t{total_words}\t{keep}')
+        if not args.distribution:
+            print(f'{id_}\t{target_language_words}\t{total_words}\t{keep}')
+        else:
+            distribution = format_distribution(label_words, args.distribution)
+            print(f'{id_}\t{target_language_words}\t{total_words}\t{keep}'
+                  f'\t{distribution}')
         
         # try:
         #     print(text_content)
@@ -318,33 +439,106 @@ def langdetect_warc_stream(stream, model, stats, args):
 def langdetect_warc(fn, model, stats, args):
     if not fn.endswith('.gz'):
         with open(fn, 'rb') as f:
-            langdetect_warc_stream(f, model, stats, args)
+            with track_progress(f, fn, stats, args) as f:
+                langdetect_warc_stream(f, model, stats, args)
     else:
         with gzip.open(fn) as f:
-            langdetect_warc_stream(f, model, stats, args)
+            with track_progress(f, fn, stats, args) as f:
+                langdetect_warc_stream(f, model, stats, args)
 
 
-def main(argv):
-    args = argparser().parse_args(argv[1:])
+def langdetect_warc_worker(fn, args):
+    stats = defaultdict(int)
+    output = StringIO()
+    with redirect_stdout(output):
+        langdetect_warc(fn, _shared_model, stats, args)
+    profiler = get_profiler(args)
+    profile = profiler.snapshot(reset=True) if profiler is not None else None
+    return (fn, output.getvalue(), stats, os.getpid(), get_memory_usage(),
+            profile)
+
+
+def write_memory_stats(worker_usages, parent_usage, out=sys.stderr):
+    def mb(usages, key, reduce_=max):
+        values = [u[key] for u in usages if key in u]
+        return f'{reduce_(values)/1024:.1f}' if values else 'N/A'
+    mean = lambda values: sum(values) / len(values)
+    usages = list(worker_usages.values())
+    print(
+        f'memory: parent RSS {mb([parent_usage], "VmRSS")} MB,',
+        f'{len(usages)} workers,',
+        f'max RSS {mb(usages, "VmRSS")} MB,',
+        f'max peak RSS {mb(usages, "VmHWM")} MB,',
+        f'mean PSS {mb(usages, "Pss", mean)} MB,',
+        f'mean private {mb(usages, "Private_Dirty", mean)} MB',
+        file=out
+    )
+
+
+def langdetect_warcs_parallel(paths, model, manifest, stats, args):
+    # The model is loaded once in the parent and inherited by forked
+    # workers; its pages stay shared as long as no process writes them.
+    global _shared_model
+    _shared_model = model
+
+    worker_usages = {}
+    context = multiprocessing.get_context('fork')
+    with context.Pool(args.processes) as pool:
+        worker = partial(langdetect_warc_worker, args=args)
+        results = pool.imap(worker, paths)
+        for path, output, file_stats, pid, usage, profile in results:
+            with manifest.track(path):
+                sys.stdout.write(output)
+            if profile is not None:
+                get_profiler(args).merge(*profile)
+            for key, value in file_stats.items():
+                stats[key] += value
+            worker_usages[pid] = usage
+
+    write_memory_stats(worker_usages, get_memory_usage())
+
+
+def pending_paths(inputs, manifest, stats, args):
+    for path in iter_paths(inputs, args.scan_cache):
+        if manifest.is_done(path):
+            logging.info(f'skipping {path} completed in manifest')
+            stats['completed inputs'] += 1
+        else:
+            yield path
 
+
+def prepare_args(args):
+    # Post-parse setup of arguments, shared with warc_worker.py
     args.word_regex = re.compile(args.word_regex)
+    return args
+
+
+def main(argv):
+    args = prepare_args(argparser().parse_args(argv[1:]))
 
+    import fasttext    # deferred so that --help etc. don't pay for it
     model = fasttext.load_model(args.model)
 
     stats = defaultdict(int)
-    for fn in args.input:
-        if os.path.isfile(fn):
-            langdetect_warc(fn, model, stats, args)
+    with open_manifest(args.manifest, __file__, args) as manifest:
+        # streamed so that processing starts while directories are scanned
+        paths = pending_paths(args.input, manifest, stats, args)
+        if args.processes > 1:
+            langdetect_warcs_parallel(paths, model, manifest, stats, args)
         else:
-            paths = glob(f'{fn}/**/*.warc.gz', recursive=True)
-            for p in sorted(paths):
+            for p in paths:
                 try:
-                    langdetect_warc(p, model, stats, args)
+                    with manifest.track(p):
+                        langdetect_warc(p, model, stats, args)
                 except Exception as e:
                     logging.error(f'failed to convert {p}: {e}')
                     raise
 
     write_stats(stats, 'DONE.')
+    write_memory_profile(get_profiler(args))
+    if stats['completed inputs']:
+        print(f'skipped {stats["completed inputs"]} inputs completed in '
+              f'{args.manifest}', file=sys.stderr)
 
 
 if __name__ == '__main__':
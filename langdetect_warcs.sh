@@ -22,8 +22,14 @@ OUTDIR="$2"
 INDIR=${INDIR%/}    # Remove trailing slash, if any
 
 if [ -e "$OUTDIR" ]; then
-    echo "Output directory $OUTDIR exists, not clobbering. Exiting." >&2
-    exit 1
+    read -n 1 -r -p "Output directory $OUTDIR exists. Continue? [y/n] "
+    echo
+    if [[ $REPLY =~ ^[Yy]$ ]]; then
+	echo "OK, detecting language for files missing from $OUTDIR."
+    else
+	echo "Exiting."
+	exit 1
+    fi
 fi
 
 # Recreate INDIR subdirectory structure containing warc.gz files in OUTDIR
@@ -40,10 +46,13 @@ PWD=`pwd -P`
 mkdir -p "$PWD/tmp"
 TASKLIST=`mktemp -p $PWD/tmp tasklist.XXX`
 
-# Create tasklist
+# Create tasklist, skipping files with a completion marker on the
+# output, which is written only when langdetect_warc.sh succeeds
 find "$INDIR" -name '*.warc.gz' | while read i; do
     o="$OUTDIR"/$(dirname ${i#$INDIR/})/$(basename $i .warc.gz).tsv
-    echo "./langdetect_warc.sh $i > $o"
+    if [ ! -e "$o.completed" ]; then
+	echo "./langdetect_warc.sh $i > $o && date > $o.completed"
+    fi
 done > $TASKLIST
 
 sbatch-greasy $TASKLIST \
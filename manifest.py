@@ -0,0 +1,240 @@
+# Manifest of input files completed by a tool, used to skip unchanged
+# inputs when rerunning on a directory.
+#
+# The manifest is a JSON lines file with one entry per completed input
+# giving its path, size, mtime and a fingerprint of its content, the
+# tool version (from the source of the tool and the local modules it
+# imports) and options, and the checksum, size and position of the
+# output written for it. An input is skipped if its entry matches the
+# current file, tool and options and the output file recorded for it is
+# still at least as long as when the input was completed. Outputs that
+# were truncated (e.g. by a job killed mid-write) or overwritten are
+# thus detected from file sizes without reading them.
+#
+# The output position is also recorded when starting an input. When a
+# run is resumed by appending to the same output, the output is first
+# truncated to the last recorded position, removing anything written
+# for an input that was interrupted before it completed.
+
+import os
+import sys
+import json
+import hashlib
+
+from contextlib import contextmanager
+
+
+# Bytes from the start and end of the input included in its fingerprint
+FINGERPRINT_BYTES = 2**16
+
+# Options that don't affect output and are ignored when comparing
+IGNORED_OPTIONS = {
+    'input', 'manifest', 'scan_cache', 'verbose', 'quiet', 'processes',
+    'telemetry', 'telemetry_interval', 'memory_profile', 'tracemalloc',
+}
+
+
+def file_fingerprint(path, size):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_BYTES))
+        if size > FINGERPRINT_BYTES:
+            f.seek(max(FINGERPRINT_BYTES, size-FINGERPRINT_BYTES))
+            digest.update(f.read(FINGERPRINT_BYTES))
+    return digest.hexdigest()
+
+
+def tool_version(tool_path):
+    # Version of a tool is identified by the content of its source and
+    # of the local modules (in the same directory) it has imported, so
+    # that e.g. changes to common.py also invalidate entries
+    tool_dir = os.path.dirname(os.path.abspath(tool_path))
+    paths = {os.path.abspath(tool_path)}
+    for module in list(sys.modules.values()):
+        path = getattr(module, '__file__', None)
+        if path is not None and path.endswith('.py'):
+            path = os.path.abspath(path)
+            if os.path.dirname(path) == tool_dir:
+                paths.add(path)
+    digest = hashlib.blake2b(digest_size=8)
+    for path in sorted(paths):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def output_options(args):
+    options = {
+        k: v for k, v in vars(args).items() if k not in IGNORED_OPTIONS
+    }
+    return json.loads(json.dumps(options, sort_keys=True, default=str))
+
+
+def stdout_file():
+    # Returns path of the regular file stdout is redirected to, if any
+    try:
+        sys.stdout.flush()
+        path = os.readlink('/proc/self/fd/1')
+    except OSError:
+        return None
+    if not os.path.isfile(path):
+        return None
+    return path
+
+
+class _HashingWriter:
+    # Passes writes through to out, computing checksum of UTF-8 output
+    def __init__(self, out):
+        self.out = out
+        self.digest = hashlib.sha1()
+        self.size = 0
+
+    def write(self, string):
+        data = string.encode('utf-8')
+        self.digest.update(data)
+        self.size += len(data)
+        return self.out.write(string)
+
+    def flush(self):
+        self.out.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.out, name)
+
+
+class Manifest:
+    def __init__(self, fn, tool_path, args):
+        self.fn = fn
+        self.tool = os.path.basename(tool_path)
+        self.version = tool_version(tool_path)
+        self.options = output_options(args)
+        self.entries = {}
+        self.positions = {}    # last recorded position by output
+        if os.path.exists(fn):
+            with open(fn, encoding='utf-8') as f:
+                for l in f:
+                    try:
+                        entry = json.loads(l)
+                    except ValueError:
+                        continue    # partially written last line
+                    self.add_entry(entry)
+        self.out = open(fn, 'a', encoding='utf-8')
+        self.resume_output()
+
+    def add_entry(self, entry):
+        if entry.get('output') is not None:
+            position = entry.get('output_end', entry.get('output_start'))
+            self.positions[entry['output']] = position
+        if not entry.get('started'):
+            self.entries[entry['path']] = entry
+
+    def resume_output(self):
+        # Truncate the output to the last recorded position, removing
+        # partial output of an interrupted input
+        output = stdout_file()
+        if output is None or output not in self.positions:
+            return
+        position = self.positions[output]
+        size = os.path.getsize(output)
+        if size > position:
+            print(f'manifest: truncating {output} from {size} to {position} '
+                  f'bytes, removing output of interrupted input',
+                  file=sys.stderr)
+            os.truncate(output, position)
+
+    def is_done(self, path):
+        entry = self.entries.get(os.path.abspath(path))
+        if entry is None:
+            return False
+        if (entry['tool'] != self.tool or
+            entry['version'] != self.version or
+            entry['options'] != self.options):
+            return False
+        stat = os.stat(path)
+        if entry['size'] != stat.st_size:
+            return False
+        if (entry['mtime'] != stat.st_mtime_ns and
+            entry['fingerprint'] != file_fingerprint(path, stat.st_size)):
+            return False    # changed (not just e.g. copied or touched)
+        if entry['output'] is not None:
+            try:
+                if os.path.getsize(entry['output']) < entry['output_end']:
+                    return False    # truncated or overwritten
+            except OSError:
+                return False    # removed
+        return True
+
+    @contextmanager
+    def track(self, path):
+        # Record path as completed with output written to stdout within
+        # the context if no exception is raised
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        fingerprint = file_fingerprint(path, stat.st_size)
+        output = stdout_file()
+        if output is not None:
+            self.write_entry({
+                'path': path,
+                'started': True,
+                'output': output,
+                'output_start': os.path.getsize(output),
+            })
+        writer = _HashingWriter(sys.stdout)
+        sys.stdout = writer
+        try:
+            yield
+        finally:
+            sys.stdout = writer.out
+        output = stdout_file()
+        entry = {
+            'path': path,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'fingerprint': fingerprint,
+            'tool': self.tool,
+            'version': self.version,
+            'options': self.options,
+            'output': output,
+            'output_end': os.path.getsize(output) if output else None,
+            'output_size': writer.size,
+            'output_sha1': writer.digest.hexdigest(),
+        }
+        self.write_entry(entry)
+
+    def write_entry(self, entry):
+        self.add_entry(entry)
+        print(json.dumps(entry), file=self.out, flush=True)
+
+    def close(self):
+        self.out.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _NullManifest:
+    # Stand-in for Manifest when none is given
+    def is_done(self, path):
+        return False
+
+    @contextmanager
+    def track(self, path):
+        yield
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+def open_manifest(fn, tool_path, args):
+    # Manifest if fn is not None, otherwise one that records nothing.
+    # Use as context manager.
+    if fn is None:
+        return _NullManifest()
+    else:
+        return Manifest(fn, tool_path, args)
@@ -0,0 +1,134 @@
+# Optional per-record memory instrumentation for finding the records
+# that determine the memory a job needs (huge payloads, large parse
+# trees, etc.).
+#
+# Around reading and extracting each record, the profiler samples RSS
+# and, with tracemalloc enabled, the peak of memory allocated by Python
+# while processing the record. The top N records by either measure are
+# kept with their IDs and sizes and reported at the end together with
+# the peak RSS of the process. RSS only grows when the process needs
+# more memory from the OS, so the RSS delta points at records that
+# raised the high-water mark; the tracemalloc peak also catches
+# temporary allocations that were freed (but not C library memory, e.g.
+# lxml trees).
+
+import os
+import sys
+import heapq
+
+from common import get_memory_usage
+
+
+# Size of a memory page for reading /proc/self/statm
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+# Per-process profiler, see get_profiler()
+_profiler = None
+
+
+def current_rss():
+    # Current RSS in bytes, or None if not available
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        return None
+
+
+class MemoryProfiler:
+    def __init__(self, top_n=10, trace=False):
+        self.top_n = top_n
+        self.trace = trace
+        self.top = []    # min-heap of (delta, id, size, rss delta, peak)
+        self.current = None
+        self.records = 0
+        if trace:
+            import tracemalloc
+            self.tracemalloc = tracemalloc
+            tracemalloc.start()
+
+    def begin(self, id_, size):
+        # Start measuring record id_ of given size. Records for which
+        # end() is not called (e.g. skipped or failed records) are
+        # discarded, so they are neither counted nor charged to others.
+        self.discard()
+        traced = None
+        if self.trace:
+            self.tracemalloc.reset_peak()
+            traced = self.tracemalloc.get_traced_memory()[0]
+        self.current = (id_, size, current_rss(), traced)
+
+    def discard(self):
+        self.current = None
+
+    def end(self):
+        if self.current is None:
+            return
+        id_, size, rss_before, traced_before = self.current
+        self.current = None
+        self.records += 1
+        rss_after = current_rss()
+        rss_delta = None
+        if rss_before is not None and rss_after is not None:
+            rss_delta = rss_after - rss_before
+        traced_peak = None
+        if self.trace:
+            traced_peak = self.tracemalloc.get_traced_memory()[1] - \
+                traced_before
+        delta = max(rss_delta or 0, traced_peak or 0)
+        self.add((delta, id_, size, rss_delta, traced_peak))
+
+    def add(self, entry):
+        if len(self.top) < self.top_n:
+            heapq.heappush(self.top, entry)
+        elif entry[0] > self.top[0][0]:
+            heapq.heapreplace(self.top, entry)
+
+    def merge(self, entries, records=0):
+        # Add top entries from another process
+        for entry in entries:
+            self.add(tuple(entry))
+        self.records += records
+
+    def snapshot(self, reset=False):
+        # Returns top entries and number of records profiled, clearing
+        # them if reset (e.g. after each file in a worker process)
+        self.discard()
+        top, records = list(self.top), self.records
+        if reset:
+            self.top, self.records = [], 0
+        return top, records
+
+
+def get_profiler(args):
+    # Per-process profiler if --memory-profile is given, otherwise None
+    global _profiler
+    if not args.memory_profile:
+        return None
+    if _profiler is None:
+        _profiler = MemoryProfiler(args.memory_profile, args.tracemalloc)
+    return _profiler
+
+
+def write_memory_profile(profiler, out=sys.stderr):
+    if profiler is None:
+        return
+    mb = lambda b: 'N/A' if b is None else f'{b/2**20:.1f}'
+    usage = get_memory_usage()
+    peak = usage.get('VmHWM')
+    top, records = profiler.snapshot()
+    print(f'memory: peak RSS {mb(peak*1024 if peak else None)} MB, '
+          f'{records} records profiled', file=out)
+    print(f'memory: top {len(top)} records by memory delta (MB): '
+          f'ID, size, RSS delta, traced peak', file=out)
+    for delta, id_, size, rss_delta, traced_peak in sorted(top, reverse=True):
+        print(f'memory:\t{id_}\t{size}\t{mb(rss_delta)}\t{mb(traced_peak)}',
+              file=out)
+
+
+def add_memory_profile_arguments(ap):
+    ap.add_argument('--memory-profile', metavar='N', type=int, default=0,
+                    help='report N records using most memory and peak RSS')
+    ap.add_argument('--tracemalloc', default=False, action='store_true',
+                    help='also trace Python allocations with --memory-profile '
+                    '(slow)')
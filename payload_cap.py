@@ -0,0 +1,64 @@
+# Caps on the size of record payloads read into memory, so that a
+# single huge response does not determine the memory a job needs.
+#
+# The Content-Length of a WARC record gives the size of its block
+# before it is read, so payloads over the cap can be skipped without
+# reading them (the iterator then discards them in fixed-size chunks).
+# With truncation, at most the cap is read. As Content-Length is that
+# of the encoded payload, the decoded payload (e.g. Content-Encoding:
+# gzip) is also read only up to the cap. Where only a hash of the
+# payload is needed, oversized payloads can instead be hashed in
+# chunks without holding them in memory.
+
+import sys
+
+from common import parse_size, read_payload
+
+
+# Actions for payloads over the cap
+OVERSIZE_ACTIONS = ('skip', 'truncate')
+
+# Stats keys for capped payloads by action
+OVERSIZE_STATS = {
+    'skip': 'oversize skipped',
+    'truncate': 'oversize truncated',
+    'hash': 'oversize hashed',
+}
+
+
+def read_capped_payload(record, stats, args):
+    # Payload capped by args.max_payload, or None if it was skipped.
+    # Capped payloads are counted in stats.
+    action = getattr(args, 'oversize', 'skip')
+    payload, complete = read_payload(record, args.max_payload,
+                                     action == 'truncate')
+    if complete:
+        return payload
+    elif action == 'truncate':
+        stats[OVERSIZE_STATS['truncate']] += 1
+        return payload
+    else:
+        # also with "hash" if the decoded payload was over the cap
+        stats[OVERSIZE_STATS['skip']] += 1
+        return None
+
+
+def write_cap_stats(stats, label, out=sys.stderr):
+    counts = [
+        f'{stats[key]} {key}' for key in OVERSIZE_STATS.values()
+        if stats.get(key)
+    ]
+    if counts:
+        print(f'{label}', 'payload cap:', ', '.join(counts), file=out)
+
+
+def add_payload_cap_arguments(ap, actions=OVERSIZE_ACTIONS):
+    ap.add_argument('--max-payload', metavar='SIZE', type=parse_size,
+                    default=None, help='cap on payload size (e.g. 10M)')
+    if len(actions) > 1:
+        help_ = 'action for payloads over --max-payload'
+        if 'hash' in actions:
+            help_ += ('; "hash" hashes the payload instead of its text, '
+                      'matching only exact copies of the payload')
+        ap.add_argument('--oversize', choices=actions, default=actions[0],
+                        help=help_)
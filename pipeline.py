@@ -0,0 +1,242 @@
+# Generator-based API for composing WARC processing steps in one
+# process. A source yields lightweight Document objects with the record
+# payload read once, and each stage takes an iterable of documents and
+# yields documents, so stages can be chained without re-reading records
+# or serializing text between processes. For example
+#
+#     stats = defaultdict(int)
+#     docs = run_pipeline(
+#         read_warcs(iter_paths(['crawl/']), stats),
+#         partial(skip_unsupported, stats=stats),
+#         partial(extract_text, stats=stats),
+#         partial(annotate, name='length', func=lambda d: len(d.text)),
+#         partial(filter_docs, pred=lambda d: d.meta['length'] > 100),
+#     )
+#     write_jsonl(docs)
+#
+# Counts are kept in the stats dict as in the command-line tools. Give
+# max_payload to the sources to skip (or truncate) payloads over a
+# number of bytes without reading them into memory.
+
+import sys
+import gzip
+import json
+import logging
+
+from functools import reduce
+
+from common import (
+    get_record_id,
+    get_target_uri,
+    get_mime_type,
+    get_text_content,
+    is_hash_sampled,
+    is_unsupported_mime_type,
+    read_payload,
+)
+
+
+# Record types read by default
+DEFAULT_RECORD_TYPES = ('response', 'conversion')
+
+
+class Document:
+    # Record with payload and (once extracted) text, independent of
+    # warcio so that it can be kept after the iterator moves on
+    __slots__ = ('id', 'uri', 'rec_type', 'mime_type', 'date', 'content',
+                 'text', 'meta')
+
+    def __init__(self, id_, uri, rec_type, mime_type, date, content):
+        self.id = id_
+        self.uri = uri
+        self.rec_type = rec_type
+        self.mime_type = mime_type
+        self.date = date
+        self.content = content
+        self.text = None
+        self.meta = {}
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'text': self.text,
+            'meta': {
+                'uri': self.uri,
+                'source_type': self.mime_type,
+                'download_date': self.date,
+                **self.meta,
+            },
+        }
+
+
+def run_pipeline(source, *stages):
+    # Chain stages (functions from iterable to iterable) onto source
+    return reduce(lambda docs, stage: stage(docs), stages, source)
+
+
+# Sources
+
+def read_warc_stream(stream, stats, rec_types=DEFAULT_RECORD_TYPES,
+                     max_payload=None, truncate=False):
+    from warcio.archiveiterator import ArchiveIterator    # deferred
+
+    for record in ArchiveIterator(stream):
+        stats['total'] += 1
+        if record.rec_type not in rec_types:
+            continue
+        stats[f'{record.rec_type}s'] += 1
+        content, complete = read_payload(record, max_payload, truncate)
+        if not complete:
+            if not truncate:
+                stats['oversize skipped'] += 1
+                continue
+            stats['oversize truncated'] += 1
+        yield Document(
+            get_record_id(record),
+            get_target_uri(record),
+            record.rec_type,
+            get_mime_type(record),
+            record.rec_headers.get_header('WARC-Date'),
+            content,
+        )
+
+
+def read_warcs(paths, stats, rec_types=DEFAULT_RECORD_TYPES,
+               max_payload=None, truncate=False):
+    for path in paths:
+        if path.endswith('.gz'):
+            with gzip.open(path) as f:
+                yield from read_warc_stream(f, stats, rec_types,
+                                            max_payload, truncate)
+        else:
+            with open(path, 'rb') as f:
+                yield from read_warc_stream(f, stats, rec_types,
+                                            max_payload, truncate)
+
+
+# Filters
+
+def filter_docs(docs, pred, stats=None, label='filtered'):
+    for doc in docs:
+        if pred(doc):
+            yield doc
+        elif stats is not None:
+            stats[label] += 1
+
+
+def skip_empty(docs, stats):
+    for doc in docs:
+        if not doc.content:
+            logging.warning(f'empty content: {doc.id}')
+            stats['empties'] += 1
+        else:
+            yield doc
+
+
+def skip_unsupported(docs, stats):
+    for doc in docs:
+        if is_unsupported_mime_type(doc.mime_type):
+            logging.info(f'unsupported payload type: {doc.mime_type}')
+            stats['unsupported'] += 1
+        else:
+            yield doc
+
+
+def sample_docs(docs, ratio, key='id'):
+    # Deterministic sample by hash of given Document attribute
+    for doc in docs:
+        if is_hash_sampled(getattr(doc, key) or '', ratio):
+            yield doc
+
+
+# Extractors
+
+def extract_text(docs, stats, trafilatura_options=None):
+    # Sets text of documents, dropping those with no text
+    for doc in docs:
+        if not doc.content:
+            stats['empties'] += 1
+            continue
+        try:
+            text = get_text_content(doc.id, doc.mime_type, doc.content,
+                                    trafilatura_options)
+        except Exception as e:
+            logging.error(f'failed extract for {doc.id}: {e}')
+            stats['errors'] += 1
+            continue
+        if text:
+            text = text.replace('\x00', '')    # remove nulls
+        if not text:
+            logging.info(f'empty text content: {doc.id}')
+            stats['empties'] += 1
+            continue
+        doc.text = text
+        yield doc
+
+
+def drop_content(docs):
+    # Free payloads that are no longer needed after extraction
+    for doc in docs:
+        doc.content = None
+        yield doc
+
+
+# Annotators
+
+def annotate(docs, name, func):
+    # Sets doc.meta[name] to func(doc)
+    for doc in docs:
+        doc.meta[name] = func(doc)
+        yield doc
+
+
+def annotate_batches(docs, name, func, batch_size=64):
+    # Sets doc.meta[name] from func applied to lists of documents, for
+    # annotators that are faster on batches (e.g. fastText predict)
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield from _annotate_batch(batch, name, func)
+            batch = []
+    yield from _annotate_batch(batch, name, func)
+
+
+def _annotate_batch(batch, name, func):
+    if not batch:
+        return
+    for doc, value in zip(batch, func(batch)):
+        doc.meta[name] = value
+    yield from batch
+
+
+# Sinks
+
+def write_jsonl(docs, out=sys.stdout):
+    count = 0
+    for doc in docs:
+        print(json.dumps(doc.to_dict(), ensure_ascii=False), file=out)
+        count += 1
+    return count
+
+
+def write_tsv(docs, fields, out=sys.stdout):
+    # Fields are Document attributes or keys of doc.meta
+    count = 0
+    for doc in docs:
+        values = [
+            getattr(doc, f) if f in Document.__slots__ else doc.meta.get(f)
+            for f in fields
+        ]
+        print('\t'.join(str(v) for v in values), file=out)
+        count += 1
+    return count
+
+
+def write_warc_ids(docs, out=sys.stdout):
+    # IDs of documents, e.g. for filter_warc.py
+    count = 0
+    for doc in docs:
+        print(doc.id, file=out)
+        count += 1
+    return count
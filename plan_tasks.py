@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+# Write a GREASY (or Slurm array) tasklist running a command on WARC
+# files, packing files into tasks of about a target wall time. The cost
+# of a file is estimated from its size and a processing rate, which can
+# be calibrated from a report of earlier runs (e.g. check_warc.py -r).
+# Files are packed longest first (worst-fit decreasing) and tasks are
+# written longest first so that the slowest tasks start first. Sizes of
+# files in --list are taken from an optional second (tab-separated)
+# column, the file if it exists locally or a --sizes report; files of
+# unknown size get --default-size, and as files of equal cost keep their
+# order, a list without sizes is run in list order. The
+# commands of a task are all run and the task fails if any of them
+# fails, so that GREASY reports failures of any file in the task.
+#
+# The command is a template where {input} is replaced with the input
+# path (or URL with --base-url), {output} with the corresponding path
+# under the output directory and {seed} with a per-file random seed.
+# Other text in braces (e.g. "{language}") is left as is.
+
+import os
+import re
+import sys
+import json
+import heapq
+import shlex
+
+from argparse import ArgumentParser
+
+from warc_files import iter_files
+
+
+# Default processing rate in MB/s for cost estimates
+DEFAULT_RATE = 2.0
+
+# Default size for files of unknown size (e.g. URLs), about the size of
+# a Common Crawl WARC file
+DEFAULT_SIZE = 2**30
+
+# Fixed per-file overhead in seconds (startup, model loading, etc.)
+DEFAULT_OVERHEAD = 5.0
+
+# Input file suffix, replaced by --output-suffix
+INPUT_SUFFIX = '.warc.gz'
+
+
+def argparser():
+    ap = ArgumentParser(description='Write tasklist for WARC files')
+    ap.add_argument('command', help='command template, e.g. '
+                    '"./filter_warc.sh IDS {input} {output}"')
+    ap.add_argument('input', nargs='*', metavar='FILE-OR-DIR')
+    ap.add_argument('-l', '--list', metavar='FILE', default=None,
+                    help='read input paths from FILE (e.g. warc.paths)')
+    ap.add_argument('-b', '--base-url', default=None,
+                    help='prefix paths from --list with URL for {input}')
+    ap.add_argument('-d', '--output-dir', default='.',
+                    help='output directory for {output}')
+    ap.add_argument('--output-suffix', default=None,
+                    help=f'replace {INPUT_SUFFIX} with suffix in {{output}}')
+    ap.add_argument('--path-sub', metavar=('REGEX', 'REPL'), nargs=2,
+                    action='append', default=[],
+                    help='substitute in relative path of {output}')
+    ap.add_argument('-s', '--skip-existing', default=False,
+                    action='store_true',
+                    help='skip files with output.completed marker (outputs '
+                    'without one are taken to be partial)')
+    ap.add_argument('--mkdir', default=False, action='store_true',
+                    help='create output directories')
+    ap.add_argument('-t', '--task-time', metavar='SEC', type=float,
+                    default=3600,
+                    help='target task wall time (0 for one file per task)')
+    ap.add_argument('-r', '--rate', metavar='MB/S', type=float,
+                    default=DEFAULT_RATE, help='processing rate for estimates')
+    ap.add_argument('-c', '--calibrate', metavar='FILE', default=None,
+                    help='estimate rate from TSV or JSON report with "bytes" '
+                    'and "seconds" per file')
+    ap.add_argument('--overhead', metavar='SEC', type=float,
+                    default=DEFAULT_OVERHEAD, help='per-file overhead')
+    ap.add_argument('--sizes', metavar='FILE', default=None,
+                    help='take sizes of files in --list from TSV or JSON '
+                    'report with "file" and "bytes" (e.g. check_warc.py -r), '
+                    'matching by file name')
+    ap.add_argument('--default-size', metavar='BYTES', type=int,
+                    default=DEFAULT_SIZE,
+                    help='size of files in --list of unknown size')
+    ap.add_argument('--seed', metavar=('START', 'STEP'), type=int, nargs=2,
+                    default=(0, 1), help='seeds for {seed}')
+    ap.add_argument('--max-tasks', metavar='N', type=int, default=None,
+                    help='write at most N tasks')
+    ap.add_argument('--time-margin', metavar='X', type=float, default=1.5,
+                    help='factor for suggested time limit')
+    return ap
+
+
+def format_time(seconds):
+    seconds = int(seconds + 0.5)
+    return f'{seconds//3600}:{seconds//60%60:02d}:{seconds%60:02d}'
+
+
+def load_report(fn):
+    # Returns list of dicts from TSV with header or JSON (list or lines)
+    with open(fn, encoding='utf-8') as f:
+        data = f.read()
+    if data.lstrip().startswith(('[', '{')):
+        if data.lstrip().startswith('['):
+            return json.loads(data)
+        return [json.loads(l) for l in data.splitlines() if l.strip()]
+    lines = data.splitlines()
+    fields = lines[0].split('\t')
+    return [dict(zip(fields, l.split('\t'))) for l in lines[1:] if l]
+
+
+def calibrate_rate(fn, overhead):
+    total_bytes, total_seconds = 0, 0
+    for item in load_report(fn):
+        try:
+            bytes_, seconds = int(item['bytes']), float(item['seconds'])
+        except (KeyError, ValueError, TypeError):
+            continue
+        total_bytes += bytes_
+        total_seconds += max(seconds - overhead, 0)
+    if not total_bytes or not total_seconds:
+        raise ValueError(f'no bytes and seconds in {fn}')
+    return total_bytes / 2**20 / total_seconds
+
+
+def load_sizes(fn):
+    # Returns dict mapping file name (without directory) to size
+    sizes = {}
+    for item in load_report(fn):
+        try:
+            sizes[os.path.basename(item['file'])] = int(item['bytes'])
+        except (KeyError, ValueError, TypeError):
+            continue
+    return sizes
+
+
+def list_size(path, size, sizes, args):
+    # Size of file in --list with size from list (or None)
+    if size is not None:
+        return int(size)
+    elif args.base_url is None and os.path.isfile(path):
+        return os.path.getsize(path)
+    else:
+        return sizes.get(os.path.basename(path), args.default_size)
+
+
+def iter_inputs(args):
+    # Yields (input, relative path, size)
+    if args.list is not None:
+        sizes = load_sizes(args.sizes) if args.sizes is not None else {}
+        with open(args.list, encoding='utf-8') as f:
+            for l in f:
+                fields = l.strip().split('\t')
+                if not fields[0]:
+                    continue
+                path, size = fields[0], fields[1] if len(fields) > 1 else None
+                if args.base_url is not None:
+                    input_ = f'{args.base_url.rstrip("/")}/{path}'
+                else:
+                    input_ = path
+                yield input_, path, list_size(path, size, sizes, args)
+    for input_ in args.input:
+        root = input_ if os.path.isdir(input_) else os.path.dirname(input_)
+        for path, size in iter_files([input_]):
+            yield path, os.path.relpath(path, root), size
+
+
+def output_path(relpath, args):
+    for regex, repl in args.path_sub:
+        relpath = re.sub(regex, repl, relpath)
+    if args.output_suffix is not None and relpath.endswith(INPUT_SUFFIX):
+        relpath = relpath[:-len(INPUT_SUFFIX)] + args.output_suffix
+    return os.path.join(args.output_dir, relpath)
+
+
+def is_done(output):
+    # only trust outputs marked complete, as a failed or killed command
+    # may leave a partial output behind
+    return os.path.exists(f'{output}.completed')
+
+
+def make_command(template, input_, output, seed):
+    command = template.replace('{input}', input_)
+    command = command.replace('{output}', output)
+    command = command.replace('{seed}', str(seed))
+    return command
+
+
+def task_command(commands):
+    # Run all commands, exiting with non-zero status if any failed
+    if len(commands) == 1:
+        return commands[0]
+    script = '; '.join(['rc=0'] + [f'{c} || rc=1' for c in commands] +
+                       ['exit $rc'])
+    return f'bash -c {shlex.quote(script)}'
+
+
+def pack_tasks(items, capacity):
+    # Worst-fit decreasing bin packing of (cost, command) items: each
+    # item goes to the task with the most room left, kept in a heap so
+    # that packing is O(n log n). Returns list of (total cost, commands)
+    # sorted by decreasing cost.
+    items = sorted(items, key=lambda i: i[0], reverse=True)
+    if capacity <= 0:
+        return [(cost, [command]) for cost, command in items]
+    tasks, heap = [], []    # heap of (-room, task index)
+    for cost, command in items:
+        if heap and -heap[0][0] >= cost:
+            room, index = heapq.heappop(heap)
+            tasks[index][0] += cost
+            tasks[index][1].append(command)
+            heapq.heappush(heap, (room+cost, index))
+        else:
+            tasks.append([cost, [command]])
+            heapq.heappush(heap, (cost-capacity, len(tasks)-1))
+    tasks.sort(key=lambda t: t[0], reverse=True)
+    return [(cost, commands) for cost, commands in tasks]
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+
+    if args.list is None and not args.input:
+        argparser().error('give FILE-OR-DIR or --list')
+
+    rate = args.rate
+    if args.calibrate is not None:
+        rate = calibrate_rate(args.calibrate, args.overhead)
+        print(f'calibrated rate {rate:.2f} MB/s from {args.calibrate}',
+              file=sys.stderr)
+
+    items, skipped, dirs = [], 0, set()
+    seed_start, seed_step = args.seed
+    for input_, relpath, size in iter_inputs(args):
+        output = output_path(relpath, args)
+        if args.skip_existing and is_done(output):
+            skipped += 1
+            continue
+        seed = seed_start + len(items) * seed_step
+        cost = args.overhead + size / 2**20 / rate
+        items.append((cost, make_command(args.command, input_, output, seed)))
+        dirs.add(os.path.dirname(output))
+
+    tasks = pack_tasks(items, args.task_time)
+    if args.max_tasks is not None and len(tasks) > args.max_tasks:
+        print(f'max tasks ({args.max_tasks}) reached, skipping remaining',
+              file=sys.stderr)
+        tasks = tasks[:args.max_tasks]
+
+    if args.mkdir:
+        for d in sorted(dirs):
+            os.makedirs(d, exist_ok=True)
+
+    for cost, commands in tasks:
+        print(task_command(commands))
+
+    files = sum(len(c) for _, c in tasks)
+    longest = tasks[0][0] if tasks else 0
+    print(f'wrote {len(tasks)} tasks for {files} files, skipped {skipped}; '
+          f'total estimate {format_time(sum(c for c, _ in tasks))}, '
+          f'longest task {format_time(longest)}, suggested time limit '
+          f'{format_time(longest * args.time_margin)}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -9,18 +9,34 @@ BASEURL="https://commoncrawl.s3.amazonaws.com"
 # Slurm account
 ACCOUNT=project_2004153
 
-# Maximum number of GREASY steps to run
+# Maximum number of GREASY steps to run. Each step is a task of one
+# file, so this also limits the number of files.
 MAX_STEPS=20000
 
+# Optional report with sizes of the crawl's WARC files (TSV or JSON with
+# "file" and "bytes", e.g. from check_warc.py -r) for starting the
+# largest files first. warc.paths has no sizes, so without a report the
+# files are run in warc.paths order.
+SIZES=""
+
 INITIAL_RANDOM_SEED=6472
 RANDOM_SEED_INCREMENT=163
 
+# Sample randomly ("random") or by hash of record ID ("id") or target
+# URI ("uri"). Hash-based samples don't depend on seeds and are stable
+# across reruns.
+SAMPLE_KEY=random
+
+# fasttext language identification model for LANGUAGE other than "any"
+MODEL="$(pwd -P)/lid.176.bin"
+
 set -euo pipefail
 
 # Command-line arguments
 if [ $# -lt 1 ]; then
     echo -e "Usage: $0 CRAWL-ID [SAMPLE-RATIO] [NODES] [OUTDIR] [LANGUAGE]" >&2
     echo -e "Example: $0 CC-MAIN-2021-04 0.1 10 sampled" >&2
+    echo -e "LANGUAGE can be e.g. fi,sv:0.5 for output per language" >&2
     exit 1
 fi
 
@@ -30,6 +46,12 @@ NODES="${3:-10}"
 OUTDIR="${4:-sampled}"
 LANGUAGE="${5:-any}"
 
+if [ "$LANGUAGE" != "any" -a ! -e "$MODEL" ]; then
+    echo "Language identification model $MODEL not found, download it from" >&2
+    echo "https://fasttext.cc/docs/en/language-identification.html" >&2
+    exit 1
+fi
+
 if [ -e "$OUTDIR" ]; then
     read -n 1 -r -p "Output directory $OUTDIR exists. Continue? [y/n] "
     echo
@@ -69,36 +91,30 @@ TASKLIST=`mktemp -p $PWD/tmp tasklist.XXX`
 # Create tasklist
 path_count=$(wc -l < "$TMPDIR/warc.paths")
 echo "Creating tasklist $TASKLIST from $path_count paths ..." >&2
-set +e
-count=0
-skip=0
-seed=$INITIAL_RANDOM_SEED
-while read p; do
-    if [ $count -ge $MAX_STEPS ]; then
-	echo "MAX_STEPS ($MAX_STEPS) reached, skipping remaining" >&2
-	break
-    fi
-    url="$BASEURL/$p"
-    # exclude common prefix and "/warc" suffix from output path
-    dir=$(echo $(dirname "$p") | perl -pe 's|'"$prefix"'/?||; s|/warc$||')
-    out="$OUTDIR/$dir/$(basename $p)"
-    if [ -e "$out" ]; then
-	# echo "$out exists, skipping $p" >&2
-	skip=$((skip+1))
-	if [ $((skip % 1000)) -eq 0 ]; then
-	    echo "Skippped $skip ..." >&2
-	fi
-    else
-	echo "./sample_warc_url.sh $RATIO $LANGUAGE $url $out $seed"
-	count=$((count+1))
-	seed=$((seed+RANDOM_SEED_INCREMENT))
-	if [ $((count % 1000)) -eq 0 ]; then
-	    echo "Processed $count ..." >&2
-	fi
-    fi
-done < <(cat "$TMPDIR/warc.paths") > "$TASKLIST"
-
-echo "Wrote tasklist with $count tasks, skipped $skip." >&2
+if [[ "$LANGUAGE" == *,* ]]; then
+    # one output per language from a single download, with completion
+    # marker under the literal "{language}" directory
+    out_dir="$OUTDIR/{language}"
+else
+    out_dir="$OUTDIR"
+fi
+# one download per step; exclude common prefix and "/warc" directory
+# from output path
+python plan_tasks.py \
+    --list "$TMPDIR/warc.paths" \
+    ${SIZES:+--sizes "$SIZES"} \
+    --base-url "$BASEURL" \
+    --path-sub "^$prefix/?" "" \
+    --path-sub "/warc/([^/]*)$" "/\\1" \
+    --output-dir "$out_dir" \
+    --skip-existing \
+    --task-time 0 \
+    --max-tasks $MAX_STEPS \
+    --seed $INITIAL_RANDOM_SEED $RANDOM_SEED_INCREMENT \
+    "./sample_warc_url.sh $RATIO $LANGUAGE {input} {output} {seed} $SAMPLE_KEY $MODEL" \
+    > "$TASKLIST"
+
+count=$(wc -l < "$TASKLIST")
 if [ $count -eq 0 ]; then
     rm "$TASKLIST"
     echo "All done, exiting without tasklist." >&2
@@ -1,140 +1,357 @@
 #!/usr/bin/env python3
 
+import os
 import sys
 import random
 import gzip
 import logging
 
+from contextlib import ExitStack
+from collections import defaultdict
 from argparse import ArgumentParser
 
-from io import BytesIO
-from warcio import WARCWriter
 from warcio.archiveiterator import ArchiveIterator
-from warcio.recordloader import ArcWarcRecord
 
+from warc_members import iter_member_records, mmap_file
+from warc_writer import open_warc_writer
+from payload_cap import (
+    OVERSIZE_STATS,
+    add_payload_cap_arguments,
+    read_capped_payload,
+    write_cap_stats,
+)
+from telemetry import (
+    add_telemetry_arguments,
+    track_members,
+    track_progress,
+)
 from common import (
     get_record_id,
+    get_target_uri,
     get_payload_type,
+    buffer_payload,
     get_text_content,
     is_unsupported_mime_type,
+    is_hash_sampled,
+    is_oversize,
+    replace_unicode_errors,
+    set_trafilatura_loglevel,
 )
 
-try:
-    import trafilatura
-except ImportError:
-    logging.warning('import trafilatura failed, --language not available')
-    trafilatura = None
-
 
 ANY_LANGUAGE = 'any'
 
+# Placeholder for language in output path
+LANGUAGE_PLACEHOLDER = '{language}'
+
+# Buffer size for output files. open_warc_writer() doesn't pass on the
+# flush warcio does after each record, so the buffer is written when full.
+OUTPUT_BUFFER_SIZE = 2**20
+
+# Language identification backends for --language
+LANG_BACKENDS = ['fasttext', 'langdetect']
+
+# Default fasttext language identification model
+DEFAULT_MODEL = 'lid.176.bin'
+
+# Prefix for fasttext labels
+FASTTEXT_LABEL_PREFIX = '__label__'
+
+# Number of fasttext labels to look for target language in
+FASTTEXT_MAX_LABELS = 10
+
+# Sampling keys: random, or hash of WARC-Record-ID or WARC-Target-URI
+SAMPLE_KEYS = ['random', 'id', 'uri']
+
 
 def argparser():
     ap = ArgumentParser()
     ap.add_argument('ratio', type=float)
     ap.add_argument('warc_in')
     ap.add_argument('warc_out')
-    ap.add_argument('-l', '--language', default=ANY_LANGUAGE)
-    ap.add_argument('-p', '--lang-prob', default=0.1)
+    ap.add_argument('-l', '--language', default=ANY_LANGUAGE,
+                    metavar='LANG[:RATIO][,LANG[:RATIO]...]',
+                    help='target language(s), optionally with ratio to keep '
+                    'of sampled records; with several languages, warc_out '
+                    'must contain "{language}"')
+    ap.add_argument('-p', '--lang-prob', type=float, default=0.1,
+                    help='minimum probability of target language')
+    ap.add_argument('-b', '--lang-backend', choices=LANG_BACKENDS,
+                    default='fasttext',
+                    help='language identification backend for --language')
+    ap.add_argument('-m', '--model', default=DEFAULT_MODEL,
+                    help='fasttext model for --lang-backend fasttext')
+    ap.add_argument('--batch-size', metavar='N', type=int, default=64,
+                    help='identify language of N documents at a time')
+    ap.add_argument('--max-chars', metavar='N', type=int, default=5000,
+                    help='identify language on first N characters of text')
+    ap.add_argument('-k', '--sample-key', choices=SAMPLE_KEYS,
+                    default='random',
+                    help='sample randomly or deterministically by hash of '
+                    'record ID or target URI')
     ap.add_argument('-s', '--seed', default=None, type=int)
+    ap.add_argument('-f', '--fast', default=False, action='store_true',
+                    help='skip unsampled records without decompressing '
+                    'them (per-record gzip input, not with --language)')
+    ap.add_argument('-t', '--compress-threads', metavar='N', type=int,
+                    default=0, help='compress output in N background threads')
     ap.add_argument('-v', '--verbose', default=False, action='store_true')
+    add_payload_cap_arguments(ap, ('skip',))
+    add_telemetry_arguments(ap)
     return ap
 
 
-def copy_warc_record(record, payload):
-    return ArcWarcRecord(
-        record.format,
-        record.rec_type,
-        record.rec_headers,
-        payload,
-        record.http_headers,
-        record.content_type,
-        record.length
-    )
+def parse_languages(spec):
+    # "fi,sv:0.5" -> {'fi': 1.0, 'sv': 0.5}
+    languages = {}
+    for item in spec.split(','):
+        language, _, ratio = item.partition(':')
+        languages[language] = float(ratio) if ratio else 1.0
+    return languages
 
 
-def sample_warc_stream(ratio, warc_in, warc_out, options):
-    if options.language != ANY_LANGUAGE:
-        from langdetect import DetectorFactory, detect_langs
+def fasttext_predict(model, texts):
+    # Returns list of (labels, probs) for texts, None for texts that
+    # fasttext fails on even with unencodable characters replaced
+    k = FASTTEXT_MAX_LABELS
+    try:
+        return list(zip(*model.predict(texts, k=k)))
+    except Exception:
+        pass    # e.g. surrogates in some text
+    texts = [replace_unicode_errors(t) for t in texts]
+    try:
+        return list(zip(*model.predict(texts, k=k)))
+    except Exception:
+        pass
+    predictions = []
+    for text in texts:
+        try:
+            labels, probs = model.predict([text], k=k)
+            predictions.append((labels[0], probs[0]))
+        except Exception as e:
+            logging.error(f'failed fasttext predict: {e}')
+            predictions.append(None)
+    return predictions
+
+
+def fasttext_probabilities(model, texts, languages):
+    # fasttext predicts one line at a time, batches are lists of lines
+    texts = [' '.join(t.split('\n')) for t in texts]
+    language_probs = []
+    for prediction in fasttext_predict(model, texts):
+        if prediction is None:
+            language_probs.append(None)
+            continue
+        text_labels, text_probs = prediction
+        text_language_probs = {}
+        for label, prob in zip(text_labels, text_probs):
+            language = label[len(FASTTEXT_LABEL_PREFIX):]
+            if language in languages:
+                text_language_probs[language] = max(0.0, min(1.0, prob))
+        language_probs.append(text_language_probs)
+    return language_probs
+
+
+def langdetect_probabilities(texts, languages):
+    from langdetect import detect_langs
+    language_probs = []
+    for text in texts:
+        try:
+            langs = detect_langs(text)
+        except Exception as e:
+            logging.error(f'failed langdetect: {e}')
+            language_probs.append(None)
+            continue
+        language_probs.append({
+            l.lang: l.prob for l in langs if l.lang in languages
+        })
+    return language_probs
+
+
+def load_language_identifier(options):
+    # Returns function mapping list of texts to list of dicts with
+    # probabilities of target languages (None on error)
+    if options.lang_backend == 'fasttext':
+        import fasttext
+        model = fasttext.load_model(options.model)
+        return lambda texts: fasttext_probabilities(
+            model, texts, options.languages)
+    elif options.lang_backend == 'langdetect':
+        from langdetect import DetectorFactory
         DetectorFactory.seed = options.seed   # Make langdetect deterministic
+        return lambda texts: langdetect_probabilities(
+            texts, options.languages)
+    else:
+        raise ValueError(options.lang_backend)
+
+
+def print_counts(stats, options=None):
+    print(f'sample_warc_responses.py: processed {stats["total"]} records, '
+          f'{stats["responses"]} responses, '
+          f'{stats["unsupported"]} unsupported MIME type, '
+          f'{stats["errors"]} errors, {stats["empties"]} empty, '
+          f'{stats["notlang"]} not in target language.', file=sys.stderr)
+    if options is not None and len(options.languages) > 1:
+        print('sample_warc_responses.py: output ' + ', '.join(
+            f'{stats[f"output {l}"]} {l}' for l in options.languages
+        ), file=sys.stderr)
+    write_cap_stats(stats, 'sample_warc_responses.py:')
+
+
+def get_sample_key(record, options):
+    if options.sample_key == 'id':
+        return get_record_id(record)
+    elif options.sample_key == 'uri':
+        return get_target_uri(record)
+    else:
+        raise ValueError(options.sample_key)
+
+
+def is_sampled(record, ratio, options):
+    if options.sample_key == 'random':
+        return random.random() <= ratio
+    else:
+        return is_hash_sampled(get_sample_key(record, options), ratio)
+
+
+def is_sampled_response(record, ratio, stats, options):
+    # Sampling decision based on WARC headers only
+    stats['total'] += 1
+    if stats['total'] % 10000 == 0:
+        print_counts(stats)
+
+    if record.rec_type != 'response':
+        return False
+
+    stats['responses'] += 1
+
+    # decide hash-based sampling first
+    if options.sample_key != 'random' and not is_sampled(record, ratio,
+                                                         options):
+        return False
+
+    type_ = get_payload_type(record)
 
-    writer = WARCWriter(warc_out, gzip=True)
+    if is_unsupported_mime_type(type_):
+        stats['unsupported'] += 1
+        logging.info(f'unsupported payload type: {type_}')
+        return False
 
-    responses, total, unsupported, errors, empties, notlang = 0, 0, 0, 0, 0, 0
-    def print_counts():
-        print(f'sample_warc_responses.py: processed {total} records, '
-              f'{responses} responses, {unsupported} unsupported MIME type, '
-              f'{errors} errors, {empties} empty, '
-              f'{notlang} not in target language.', file=sys.stderr)
+    if options.sample_key == 'random' and not is_sampled(record, ratio,
+                                                         options):
+        return False
 
-    for total, record in enumerate(ArchiveIterator(warc_in), start=1):
-        if total % 10000 == 0:
-            print_counts()
+    return True
 
-        if record.rec_type != 'response':
+
+def is_language_sampled(record, ratio, language, options):
+    # Records are sampled with ratio before language identification and
+    # the ratio for the language is applied to those. Hash-based samples
+    # stay nested: kept records hash below ratio * language ratio.
+    language_ratio = options.languages[language]
+    if language_ratio >= 1:
+        return True
+    elif options.sample_key == 'random':
+        return random.random() <= language_ratio
+    else:
+        key = get_sample_key(record, options)
+        return is_hash_sampled(key, ratio*language_ratio)
+
+
+def sample_warc_members(ratio, warc_in, warc_out, stats, options,
+                        progress=None):
+    # Fast path for per-record-gzip WARCs: only WARC headers are inflated
+    # and sampled records are copied without recompression
+    for record in iter_member_records(warc_in):
+        if is_sampled_response(record, ratio, stats, options):
+            warc_out.write(warc_in[record.offset:record.offset+record.length])
+        if progress is not None:
+            progress.update(compressed=record.offset+record.length)
+    print_counts(stats)
+
+
+def sample_warc_stream(ratio, warc_in, writers, stats, options):
+    # writers maps target languages (or ANY_LANGUAGE) to WARCWriters
+    if options.language != ANY_LANGUAGE:
+        identify_language = load_language_identifier(options)
+
+    def write_record(record, id_, language):
+        try:
+            writers[language].write_record(record)
+            stats[f'output {language}'] += 1
+        except Exception as e:
+            logging.error(f'failed to write record {id_}: {e}')
+            stats['errors'] += 1
+
+    # Records waiting for language identification, see flush_batch()
+    batch = []
+    def flush_batch():
+        probs = identify_language([text for record, id_, text in batch])
+        for (record, id_, text), language_probs in zip(batch, probs):
+            if language_probs is None:
+                logging.error(f'failed language identification for {id_}')
+                stats['errors'] += 1
+                continue
+            language = max(language_probs, key=language_probs.get,
+                           default=None)
+            if (language is None or
+                language_probs[language] < options.lang_prob):
+                stats['notlang'] += 1
+                continue
+            if not is_language_sampled(record, ratio, language, options):
+                continue
+            # the iterator reads the buffered payload to its end when
+            # advancing, so rewind for writing
+            record.raw_stream.seek(0)
+            write_record(record, id_, language)
+        batch.clear()
+
+    for record in ArchiveIterator(warc_in):
+        if not is_sampled_response(record, ratio, stats, options):
             continue
 
-        responses += 1
         id_ = get_record_id(record)
         type_ = get_payload_type(record)
 
-        if is_unsupported_mime_type(type_):
-            unsupported += 1
-            logging.info(f'unsupported payload type: {type_}')
+        if options.language == ANY_LANGUAGE:
+            write_record(record, id_, ANY_LANGUAGE)
             continue
 
-        if random.random() > ratio:
+        # oversized payloads are skipped before buffering; records
+        # sampled without language identification are copied as is
+        if is_oversize(record, options.max_payload):
+            stats[OVERSIZE_STATS['skip']] += 1
             continue
 
-        if options.language != ANY_LANGUAGE:
-            # Workaround for https://github.com/webrecorder/warcio/issues/114
-            payload_copy = BytesIO(record.raw_stream.read())
-            record = copy_warc_record(record, payload_copy)
-            content = record.content_stream().read()
-            # force length recalculation to work around issues with
-            # header encoding changes causing content-length mismatch
-            # (related: https://github.com/webrecorder/warcio/issues/104)
-            record.length = None
-            payload_copy.seek(0)
-
-            try:
-                text_content = get_text_content(id_, type_, content)
-            except Exception as e:
-                logging.error(f'failed to extract text for {type_} {id_}: {e}')
-                errors += 1
-                continue
-
-            if not text_content:
-                empties += 1
-                continue
-
-            try:
-                langs = detect_langs(text_content)
-            except Exception as e:
-                logging.error(f'failed langdetect for {id_}: {e}')
-                errors += 1
-                continue
+        record = buffer_payload(record)
+        content = read_capped_payload(record, stats, options)
+        if content is None:
+            continue
+        # the payload is written out unchanged and as the payload length
+        # is known, the writer computes Content-Length from it and the
+        # re-serialized HTTP headers without buffering the record again
+        # (related: https://github.com/webrecorder/warcio/issues/104)
+        record.raw_stream.seek(0)
 
-            target_lang = [l for l in langs if l.lang == options.language]
-            target_lang = None if not target_lang else target_lang[0]
-            if target_lang is None or target_lang.prob < options.lang_prob:
-                notlang += 1
-                continue
         try:
-            writer.write_record(record)
+            text_content = get_text_content(id_, type_, content)
         except Exception as e:
-            logging.error(f'failed to write record {id_}: {e}')
-            errors += 1
+            logging.error(f'failed to extract text for {type_} {id_}: {e}')
+            stats['errors'] += 1
+            continue
 
-    print_counts()
+        if not text_content:
+            stats['empties'] += 1
+            continue
 
+        batch.append((record, id_, text_content[:options.max_chars]))
+        if len(batch) >= options.batch_size:
+            flush_batch()
 
-def set_trafilatura_loglevel(level):
-    try:
-        trafilatura.core.LOGGER.setLevel(level)
-        trafilatura.utils.LOGGER.setLevel(level)
-    except:
-        logging.warning('Failed to set trafilatura log level')
+    if batch:
+        flush_batch()
+
+    print_counts(stats, options)
 
 
 def main(argv):
@@ -148,9 +365,46 @@ def main(argv):
     else:
         set_trafilatura_loglevel(logging.CRITICAL)
 
-    with gzip.open(args.warc_in) as warc_in:
-        with open(args.warc_out, 'wb') as warc_out:
-            sample_warc_stream(args.ratio, warc_in, warc_out, args)
+    if args.fast and args.language != ANY_LANGUAGE:
+        raise ValueError('--fast cannot be combined with --language')
+
+    stats = defaultdict(int)
+
+    if args.fast:
+        with mmap_file(args.warc_in) as warc_in:
+            with open(args.warc_out, 'wb') as warc_out:
+                with track_members(args.warc_in, stats, args) as progress:
+                    sample_warc_members(args.ratio, warc_in, warc_out,
+                                        stats, args, progress)
+        return
+
+    if args.language == ANY_LANGUAGE:
+        args.languages = {}
+        outputs = {ANY_LANGUAGE: args.warc_out}
+    else:
+        args.languages = parse_languages(args.language)
+        if (len(args.languages) > 1 and
+            LANGUAGE_PLACEHOLDER not in args.warc_out):
+            raise ValueError(f'output must contain {LANGUAGE_PLACEHOLDER} '
+                             f'with several languages: {args.warc_out}')
+        outputs = {
+            l: args.warc_out.replace(LANGUAGE_PLACEHOLDER, l)
+            for l in args.languages
+        }
+
+    with ExitStack() as stack:
+        writers = {}
+        for language, fn in outputs.items():
+            if LANGUAGE_PLACEHOLDER in args.warc_out:
+                os.makedirs(os.path.dirname(fn) or '.', exist_ok=True)
+            f = stack.enter_context(open(fn, 'wb',
+                                         buffering=OUTPUT_BUFFER_SIZE))
+            writers[language] = stack.enter_context(
+                open_warc_writer(f, args.compress_threads))
+        warc_in = stack.enter_context(gzip.open(args.warc_in))
+        warc_in = stack.enter_context(
+            track_progress(warc_in, args.warc_in, stats, args))
+        sample_warc_stream(args.ratio, warc_in, writers, stats, args)
 
 
 if __name__ == '__main__':
@@ -4,4 +4,9 @@ set -euo pipefail
 
 source venv/bin/activate
 
+# marker for plan_tasks.py --skip-existing on the output (last
+# argument), written only on success
+OUT="${@: -1}"
+rm -f "$OUT.completed"
 python sample_warc_responses.py "$@"
+date > "$OUT.completed"
@@ -6,7 +6,7 @@ set -euo pipefail
 
 # Command-line arguments
 if [ $# -lt 4 ]; then
-    echo -e "Usage: $0 RATIO LANGUAGE URL OUT [SEED]" >&2
+    echo -e "Usage: $0 RATIO LANGUAGE URL OUT [SEED] [SAMPLE-KEY] [MODEL]" >&2
     exit 1
 fi
 
@@ -15,6 +15,8 @@ LANGUAGE="$2"
 URL="$3"
 OUT="$4"
 SEED="${5:-0}"
+SAMPLE_KEY="${6:-random}"
+MODEL="${7:-lid.176.bin}"    # fasttext model for LANGUAGE other than "any"
 
 echo "----------------------------------------------------------------------"
 echo "START $SLURM_JOBID: $(date): $URL"
@@ -43,8 +45,8 @@ path="$TMPDIR/$base"
 
 echo "Sampling $path ..." >&2
 source venv/bin/activate
-python sample_warc_responses.py -s "$SEED" -l "$LANGUAGE" "$RATIO" \
-    "$path" "$OUT"
+python sample_warc_responses.py -s "$SEED" -k "$SAMPLE_KEY" -l "$LANGUAGE" \
+    -m "$MODEL" "$RATIO" "$path" "$OUT"
 
 echo "Removing $path ..." >&2
 rm -rf "$path"
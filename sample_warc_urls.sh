@@ -41,14 +41,15 @@ cat "$URLFILE" | while read url; do
     base=$(basename "$url")
     path="$TMPDIR/$base"
     out="$OUTDIR/$base"
-    if [ -s "$out" ]; then
-	echo "$out exists, skipping $url ..." >&2
+    if [ -e "$out.completed" ]; then
+	echo "$out completed, skipping $url ..." >&2
 	continue
     fi
     echo "Downloading \"$url\" to $TMPDIR ..." >&2
     wget -P "$TMPDIR" -nv "$url"
     echo "Sampling $path ..." >&2
     python sample_warc_responses.py -v -s $seed "$RATIO" "$path" "$out"
+    date > "$out.completed"
     echo "Removing $path ..." >&2
     rm -rf "$path"
     seed=$((seed+RANDOM_SEED_INCREMENT))
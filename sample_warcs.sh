@@ -8,6 +8,9 @@ ACCOUNT=project_2001426
 # Maximum number of steps to run
 MAX_STEPS=40000
 
+# Target wall time of a step in seconds; files are packed into steps
+TASK_TIME=600
+
 set -euo pipefail
 
 if [ $# -ne 3 ]; then
@@ -34,37 +37,20 @@ fi
 
 module load greasy
 
-# Recreate INDIR subdirectory structure containing warc.gz files in OUTDIR
-find "$INDIR" -name '*.warc.gz' | while read i; do 
-    echo $(dirname ${i#$INDIR/}); 
-done | sort | uniq \
-    | while read d; do
-    echo "Creating directory $OUTDIR/$d"
-    mkdir -p "$OUTDIR/$d"
-done
-
 # Create temporary file for tasklist
 PWD=`pwd -P`
 mkdir -p "$PWD/tmp"
 TASKLIST=`mktemp -p $PWD/tmp tasklist.XXX`
 
-# Create tasklist
-set +e
-count=0
-find "$INDIR" -name '*.warc.gz' | while read i; do
-    if [ $count -ge $MAX_STEPS ]; then
-	echo "MAX_STEPS ($MAX_STEPS) reached, skipping remaining" >&2
-	break
-    fi
-    o="$OUTDIR"/$(dirname ${i#$INDIR/})/$(basename $i)
-    if [ -e "$o" ]; then
-	echo "$o exists, skipping $i" >&2
-    else
-	echo "./sample_warc_responses.sh $RATIO $i $o"
-	count=$((count+1))
-    fi
-done > $TASKLIST
-set -e
+# Create tasklist, recreating INDIR subdirectory structure in OUTDIR
+python plan_tasks.py \
+    --output-dir "$OUTDIR" \
+    --mkdir \
+    --skip-existing \
+    --task-time $TASK_TIME \
+    --max-tasks $MAX_STEPS \
+    "./sample_warc_responses.sh $RATIO {input} {output}" \
+    "$INDIR" > $TASKLIST
 
 sbatch-greasy $TASKLIST \
     --cores 1 \
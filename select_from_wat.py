@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+# Select WARC records by MIME type, host, URL and headers from Common
+# Crawl WAT files, which hold the headers and location of each WARC
+# record as JSON and are a fraction of the size of the WARCs. Output is
+# a selection list giving the WARC file, offset and length of the gzip
+# member of each selected record together with its ID and URI, e.g. for
+# filter_warc.py --selection to read only those members, or with --ids
+# a list of record IDs for the tools that take one.
+#
+# Selection TSV columns: WARC file name (as in the WAT, usually without
+# directory), offset, length (empty if not in the WAT), ID, URI.
+
+import os
+import re
+import sys
+import json
+import logging
+
+from collections import defaultdict
+from argparse import ArgumentParser
+from urllib.parse import urlsplit
+
+from warc_files import iter_paths
+from warc_reader import iter_records, open_warc_buffer
+
+
+# Suffix of WAT files to find in directories
+WAT_SUFFIX = '.wat.gz'
+
+# Number of fields on selection lines
+SELECTION_FIELDS = 5
+
+
+def argparser():
+    ap = ArgumentParser(description='Select WARC records from WAT metadata')
+    ap.add_argument('input', nargs='+', metavar='FILE-OR-DIR',
+                    help='WAT files or directories with .wat.gz files')
+    ap.add_argument('-t', '--type', metavar='TYPE', action='append',
+                    default=None, help='WARC record type (default response)')
+    ap.add_argument('-m', '--mime', metavar='TYPE', action='append',
+                    default=[], help='select Content-Type or identified '
+                    'payload type starting with TYPE (e.g. text/html)')
+    ap.add_argument('-H', '--host', metavar='DOMAIN', action='append',
+                    default=[], help='select hosts in DOMAIN')
+    ap.add_argument('--host-list', metavar='FILE', default=None,
+                    help='select hosts in domains listed in FILE')
+    ap.add_argument('-u', '--url', metavar='REGEX', default=None,
+                    help='select target URIs matching REGEX')
+    ap.add_argument('-s', '--status', metavar='CODE', action='append',
+                    default=[], help='select HTTP status CODE (e.g. 200)')
+    ap.add_argument('--header', metavar='NAME=REGEX', action='append',
+                    default=[], help='select HTTP response header NAME '
+                    'matching REGEX')
+    ap.add_argument('--warc-header', metavar='NAME=REGEX', action='append',
+                    default=[], help='select WARC header NAME matching REGEX '
+                    '(e.g. WARC-Identified-Content-Language=fin)')
+    ap.add_argument('-i', '--ids', default=False, action='store_true',
+                    help='only output record IDs')
+    ap.add_argument('--scan-cache', metavar='FILE', default=None,
+                    help='cache list of files found in directories in FILE')
+    ap.add_argument('-v', '--verbose', default=False, action='store_true')
+    return ap
+
+
+def parse_header_criteria(specs):
+    # ["NAME=REGEX", ...] -> [(lowercase name, compiled regex), ...]
+    criteria = []
+    for spec in specs:
+        name, sep, regex = spec.partition('=')
+        if not sep:
+            raise ValueError(f'expected NAME=REGEX: {spec}')
+        criteria.append((name.lower(), re.compile(regex)))
+    return criteria
+
+
+def load_domains(args):
+    domains = set(d.lower().strip('.') for d in args.host)
+    if args.host_list is not None:
+        with open(args.host_list, encoding='utf-8') as f:
+            for l in f:
+                if l.strip() and not l.startswith('#'):
+                    domains.add(l.strip().lower().strip('.'))
+    return domains
+
+
+def in_domains(host, domains):
+    # True if host or one of its parent domains is in domains
+    parts = host.lower().rstrip('.').split('.')
+    return any('.'.join(parts[i:]) in domains for i in range(len(parts)))
+
+
+def get_lower(headers, name, default=None):
+    # Case-insensitive lookup in WAT header dict
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return default
+
+
+class Selector:
+    def __init__(self, args):
+        self.types = set(args.type or ['response'])
+        self.mime_types = [m.lower() for m in args.mime]
+        self.domains = load_domains(args)
+        self.url_re = re.compile(args.url) if args.url is not None else None
+        self.statuses = set(args.status)
+        self.headers = parse_header_criteria(args.header)
+        self.warc_headers = parse_header_criteria(args.warc_header)
+
+    def is_selected(self, envelope, stats):
+        warc_headers = envelope.get('WARC-Header-Metadata', {})
+        if warc_headers.get('WARC-Type') not in self.types:
+            return False
+        uri = warc_headers.get('WARC-Target-URI', '')
+        payload = envelope.get('Payload-Metadata', {})
+        response = payload.get('HTTP-Response-Metadata', {})
+        http_headers = response.get('Headers', {})
+
+        if self.mime_types:
+            types = (
+                get_lower(http_headers, 'content-type', ''),
+                warc_headers.get('WARC-Identified-Payload-Type', ''),
+            )
+            if not any(t.lower().startswith(m) for t in types if t
+                       for m in self.mime_types):
+                stats['rejected mime'] += 1
+                return False
+        if self.domains:
+            host = urlsplit(uri).hostname or ''
+            if not in_domains(host, self.domains):
+                stats['rejected host'] += 1
+                return False
+        if self.url_re is not None and not self.url_re.search(uri):
+            stats['rejected url'] += 1
+            return False
+        if self.statuses:
+            status = response.get('Response-Message', {}).get('Status')
+            if status not in self.statuses:
+                stats['rejected status'] += 1
+                return False
+        for name, regex in self.headers:
+            value = get_lower(http_headers, name)
+            if value is None or not regex.search(value):
+                stats['rejected header'] += 1
+                return False
+        for name, regex in self.warc_headers:
+            value = get_lower(warc_headers, name)
+            if value is None or not regex.search(value):
+                stats['rejected warc header'] += 1
+                return False
+        return True
+
+
+def member_length(container):
+    # Compressed length of the gzip member, if in the WAT
+    gzip_metadata = container.get('Gzip-Metadata', {})
+    try:
+        return sum(int(gzip_metadata[k]) for k in
+                   ('Header-Length', 'Deflate-Length', 'Footer-Length'))
+    except (KeyError, ValueError):
+        return None
+
+
+def select_from_wat(fn, selector, stats, args):
+    with open_warc_buffer(fn) as buf:
+        for record in iter_records(buf):
+            stats['total'] += 1
+            if record.rec_type != 'metadata':
+                continue
+            try:
+                data = json.loads(bytes(record.content))
+            except ValueError as e:
+                logging.error(f'invalid JSON in {fn} at {record.offset}: {e}')
+                stats['errors'] += 1
+                continue
+            envelope, container = data.get('Envelope'), data.get('Container')
+            if envelope is None or container is None:
+                continue
+            stats['metadata'] += 1
+            if not selector.is_selected(envelope, stats):
+                continue
+            stats['selected'] += 1
+            warc_headers = envelope['WARC-Header-Metadata']
+            id_ = warc_headers.get('WARC-Record-ID')
+            if args.ids:
+                print(id_)
+            else:
+                length = member_length(container)
+                print('\t'.join([
+                    container.get('Filename', ''),
+                    str(container.get('Offset', '')),
+                    '' if length is None else str(length),
+                    id_,
+                    warc_headers.get('WARC-Target-URI', ''),
+                ]))
+
+
+def load_selection(fn, warc_fn=None):
+    # Returns sorted list of (offset, ID) in selection file fn, only for
+    # lines with WARC file name matching warc_fn if given
+    name = None if warc_fn is None else os.path.basename(warc_fn)
+    selection = []
+    with open(fn, encoding='utf-8') as f:
+        for ln, l in enumerate(f, start=1):
+            fields = l.rstrip('\n').split('\t')
+            if len(fields) != SELECTION_FIELDS:
+                raise ValueError(f'expected {SELECTION_FIELDS} fields on '
+                                 f'line {ln} in {fn}: {l}')
+            warc, offset, length, id_, uri = fields
+            if name is not None and os.path.basename(warc) != name:
+                continue
+            selection.append((int(offset), id_))
+    selection.sort()
+    return selection
+
+
+def write_stats(stats, label, out=sys.stderr):
+    print(
+        f'{label}',
+        f'{stats["total"]} records,',
+        f'{stats["metadata"]} with WARC metadata,',
+        f'{stats["selected"]} selected,',
+        f'{stats["errors"]} errors',
+        file=out
+    )
+    rejected = [(k, v) for k, v in stats.items() if k.startswith('rejected ')]
+    if rejected:
+        print(f'{label}', ', '.join(f'{k} {v}' for k, v in rejected),
+              file=out)
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+
+    logging.basicConfig()
+    if args.verbose:
+        logging.getLogger().setLevel(logging.INFO)
+
+    selector = Selector(args)
+    stats = defaultdict(int)
+    for fn in iter_paths(args.input, args.scan_cache, WAT_SUFFIX):
+        try:
+            select_from_wat(fn, selector, stats, args)
+        except Exception as e:
+            logging.error(f'failed processing {fn}: {e}')
+            stats['errors'] += 1
+        logging.info(f'processed {fn}')
+
+    write_stats(stats, 'DONE.')
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
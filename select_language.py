@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+# Make keep decisions for a target language from the output of
+# langdetect_warc.py --distribution without re-processing the WARCs.
+# Output has the same format as langdetect_warc.py with --label.
+
+import sys
+import fileinput
+
+from argparse import ArgumentParser
+
+from langdetect_warc import keep_text, parse_distribution
+
+
+def argparser():
+    ap = ArgumentParser()
+    ap.add_argument('--label', default='fi',
+                    help='label of target language')
+    ap.add_argument('--keep-words', metavar='N', type=int, default=10,
+                    help='keep if at number of target language words >= N')
+    ap.add_argument('--keep-ratio', metavar='X', type=float, default=0.25,
+                    help='keep if ratio of target language words >= X')
+    ap.add_argument('--min-ratio', metavar='X', type=float, default=0.01,
+                    help='discard if target language word ratio < X')
+    ap.add_argument('-k', '--kept-only', default=False, action='store_true',
+                    help='only output IDs of kept documents')
+    ap.add_argument('file', nargs='*',
+                    help='langdetect_warc.py --distribution output')
+    return ap
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+
+    for ln, l in enumerate(fileinput.input(args.file), start=1):
+        fields = l.rstrip('\n').split('\t')
+        if len(fields) != 5:
+            raise ValueError(f'expected 5 fields, got {len(fields)} on line '
+                             f'{ln}: {l}')
+        id_, total_words, distribution = fields[0], int(fields[2]), fields[4]
+        target_language_words = parse_distribution(distribution)[args.label]
+        keep = keep_text(target_language_words, total_words, args)
+        if args.kept_only:
+            if keep:
+                print(id_)
+        else:
+            print(f'{id_}\t{target_language_words}\t{total_words}\t{keep}')
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,174 @@
+# Periodic progress reports written as JSON lines to a side file, for
+# following throughput of running jobs and aggregating over a cluster
+# (see telemetry_summary.py).
+#
+# The input stream of a tool is wrapped in a reader that counts the
+# bytes read from it. On reads, at most once per interval, a line is
+# written with records/s (from the tool's stats) and uncompressed and
+# compressed MB/s over the last interval, position in the file as
+# percentage of compressed bytes and the estimated time to the end of
+# the file. Records are counted from the start of the file, also when
+# the tool's stats cover several files. A final line with "done": true
+# is written at the end of each file. Lines are short and appended with
+# a single write, so several processes can share one file.
+
+import os
+import io
+import sys
+import gzip
+import json
+import time
+import socket
+
+from contextlib import contextmanager
+
+
+# Default seconds between reports
+DEFAULT_INTERVAL = 30.0
+
+
+class Progress:
+    def __init__(self, fn, out, stats=None, interval=DEFAULT_INTERVAL,
+                 tool=None):
+        self.fn = fn
+        self.out = out
+        self.stats = stats
+        self.interval = interval
+        self.tool = tool or os.path.basename(sys.argv[0])
+        self.size = os.path.getsize(fn)
+        self.start = self.last_time = time.monotonic()
+        self.next_report = self.start + interval
+        # stats may count records of earlier files of the same process
+        self.initial_records = self.last_records = self.records()
+        self.last_compressed = 0
+        self.last_uncompressed = 0
+        self.compressed = 0
+        self.uncompressed = 0
+
+    def records(self):
+        return self.stats['total'] if self.stats is not None else None
+
+    def update(self, compressed=None, uncompressed=None):
+        # Positions in the compressed and uncompressed input
+        if compressed is not None:
+            self.compressed = compressed
+        if uncompressed is not None:
+            self.uncompressed = uncompressed
+        now = time.monotonic()
+        if now >= self.next_report:
+            self.report(now)
+
+    def report(self, now=None, done=False):
+        if now is None:
+            now = time.monotonic()
+        if done:
+            self.compressed = self.size
+        seconds = max(now - self.last_time, 1e-6)
+        records = self.records()
+        compressed_rate = (self.compressed-self.last_compressed) / seconds
+        uncompressed_rate = (self.uncompressed-self.last_uncompressed) / \
+            seconds
+        if compressed_rate > 0:
+            eta = (self.size - self.compressed) / compressed_rate
+        else:
+            eta = None
+        data = {
+            'time': round(time.time(), 1),
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'tool': self.tool,
+            'file': self.fn,
+            'elapsed': round(now - self.start, 1),
+            'records': None if records is None else
+                records - self.initial_records,
+            'records_per_s': None if records is None else
+                round((records-self.last_records) / seconds, 1),
+            'compressed_mb_per_s': round(compressed_rate / 2**20, 2),
+            'uncompressed_mb_per_s': round(uncompressed_rate / 2**20, 2),
+            'compressed_bytes': self.compressed,
+            'size': self.size,
+            'percent': round(100 * self.compressed / self.size, 1)
+                if self.size else 100.0,
+            'eta': None if eta is None else round(eta, 1),
+            'done': done,
+        }
+        self.out.write(json.dumps(data) + '\n')
+        self.out.flush()
+        self.last_time, self.last_records = now, records
+        self.last_compressed = self.compressed
+        self.last_uncompressed = self.uncompressed
+        self.next_report = now + self.interval
+
+
+def _compressed_position(stream):
+    # Position in the underlying file, if known
+    if isinstance(stream, gzip.GzipFile):
+        return stream.fileobj.tell
+    elif isinstance(stream, (io.BufferedReader, io.FileIO)):
+        return stream.tell
+    else:
+        return None    # e.g. zstandard reader
+
+
+class ProgressReader:
+    # Wraps a (possibly decompressing) input stream to report progress
+    def __init__(self, stream, progress):
+        self.stream = stream
+        self.progress = progress
+        self.position = _compressed_position(stream)
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.progress.uncompressed += len(data)
+        if self.position is not None:
+            self.progress.update(compressed=self.position())
+        else:
+            self.progress.update()
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+@contextmanager
+def open_telemetry(fn):
+    # Append mode text file or None if fn is None
+    if fn is None:
+        yield None
+    else:
+        with open(fn, 'a', encoding='utf-8') as out:
+            yield out
+
+
+@contextmanager
+def track_progress(stream, fn, stats, args):
+    # Yields stream wrapped to report progress to args.telemetry (if
+    # given) for input file fn, with records counted in stats['total']
+    if args.telemetry is None:
+        yield stream
+        return
+    with open_telemetry(args.telemetry) as out:
+        progress = Progress(fn, out, stats, args.telemetry_interval)
+        yield ProgressReader(stream, progress)
+        progress.report(done=True)
+
+
+@contextmanager
+def track_members(fn, stats, args):
+    # Yields Progress to update with compressed positions for tools that
+    # walk gzip members instead of reading a stream, or None
+    if args.telemetry is None:
+        yield None
+        return
+    with open_telemetry(args.telemetry) as out:
+        progress = Progress(fn, out, stats, args.telemetry_interval)
+        yield progress
+        progress.report(done=True)
+
+
+def add_telemetry_arguments(ap):
+    ap.add_argument('--telemetry', metavar='FILE', default=None,
+                    help='append progress reports as JSON lines to FILE')
+    ap.add_argument('--telemetry-interval', metavar='SEC', type=float,
+                    default=DEFAULT_INTERVAL,
+                    help='seconds between progress reports')
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+# Summarize progress reports written by tools with --telemetry, e.g.
+# from all jobs of a crawl run, using the latest report for each file.
+
+import sys
+import json
+import time
+
+from argparse import ArgumentParser
+
+
+def argparser():
+    ap = ArgumentParser(description='Summarize --telemetry reports')
+    ap.add_argument('-j', '--json', default=False, action='store_true',
+                    help='output summary as JSON')
+    ap.add_argument('-s', '--stale', metavar='SEC', type=float, default=600,
+                    help='count unfinished files without reports for SEC '
+                    'as stalled')
+    ap.add_argument('file', nargs='+', help='telemetry JSON lines files')
+    return ap
+
+
+def load_latest(fns):
+    # Returns latest report for each (host, pid, file)
+    latest = {}
+    for fn in fns:
+        with open(fn, encoding='utf-8') as f:
+            for l in f:
+                try:
+                    report = json.loads(l)
+                except ValueError:
+                    continue    # partially written line
+                key = (report['host'], report['pid'], report['file'])
+                if key not in latest or report['time'] >= latest[key]['time']:
+                    latest[key] = report
+    return list(latest.values())
+
+
+def summarize(reports, stale, now):
+    done = [r for r in reports if r['done']]
+    running = [r for r in reports if not r['done'] and
+               now - r['time'] <= stale]
+    stalled = [r for r in reports if not r['done'] and
+               now - r['time'] > stale]
+    etas = [r['eta'] for r in running if r['eta'] is not None]
+    return {
+        'files_done': len(done),
+        'files_running': len(running),
+        'files_stalled': len(stalled),
+        'records': sum(r['records'] or 0 for r in reports),
+        'compressed_bytes': sum(r['compressed_bytes'] for r in reports),
+        'records_per_s': round(sum(r['records_per_s'] or 0
+                                   for r in running), 1),
+        'compressed_mb_per_s': round(sum(r['compressed_mb_per_s']
+                                         for r in running), 2),
+        'uncompressed_mb_per_s': round(sum(r['uncompressed_mb_per_s']
+                                           for r in running), 2),
+        'max_eta': max(etas) if etas else None,
+        'stalled': sorted(r['file'] for r in stalled),
+    }
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+
+    summary = summarize(load_latest(args.file), args.stale, time.time())
+    if args.json:
+        print(json.dumps(summary))
+        return 0
+
+    print(f'{summary["files_done"]} files done, {summary["files_running"]} '
+          f'running, {summary["files_stalled"]} stalled; '
+          f'{summary["records"]} records, '
+          f'{summary["compressed_bytes"]/2**30:.2f} GB compressed')
+    print(f'current: {summary["records_per_s"]} records/s, '
+          f'{summary["compressed_mb_per_s"]} MB/s compressed, '
+          f'{summary["uncompressed_mb_per_s"]} MB/s uncompressed, '
+          f'longest ETA {summary["max_eta"]} sec')
+    for fn in summary['stalled']:
+        print(f'stalled: {fn}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+# Find WARC files in directories with os.scandir, yielding each file as
+# soon as it is found instead of listing the whole tree first as glob()
+# does. Entries are visited in sorted order within each directory, and
+# only matching files are stat'ed (for their size). File lists can be
+# cached in a file so that reruns on large directories skip the scan.
+#
+# The cache is a TSV file with root directory, path and size on each
+# line. Roots found in the cache are not rescanned; delete the cache
+# (or the lines for a root) to pick up new files.
+
+import os
+import sys
+
+from argparse import ArgumentParser
+
+
+# Default suffix of files to find
+DEFAULT_SUFFIX = '.warc.gz'
+
+
+def argparser():
+    ap = ArgumentParser(description='List WARC files in directories')
+    ap.add_argument('-c', '--cache', metavar='FILE', default=None,
+                    help='cache file lists in FILE')
+    ap.add_argument('-s', '--sizes', default=False, action='store_true',
+                    help='also output file sizes')
+    ap.add_argument('--suffix', default=DEFAULT_SUFFIX,
+                    help='suffix of files to list')
+    ap.add_argument('input', nargs='+', metavar='FILE-OR-DIR')
+    return ap
+
+
+def scan_files(root, suffix=DEFAULT_SUFFIX):
+    # Yields (path, size) for files with suffix under root
+    try:
+        with os.scandir(root) as it:
+            entries = sorted(it, key=lambda e: e.name)
+    except OSError as e:
+        print(f'warning: cannot scan {root}: {e}', file=sys.stderr)
+        return
+    for entry in entries:
+        if entry.is_dir():
+            yield from scan_files(entry.path, suffix)
+        elif entry.name.endswith(suffix) and entry.is_file():
+            yield entry.path, entry.stat().st_size
+
+
+def load_cache(fn):
+    # Returns dict mapping root to list of (path, size)
+    cached = {}
+    if fn is None or not os.path.exists(fn):
+        return cached
+    with open(fn, encoding='utf-8') as f:
+        for ln, l in enumerate(f, start=1):
+            try:
+                root, path, size = l.rstrip('\n').split('\t')
+            except ValueError:
+                raise ValueError(f'expected ROOT<TAB>PATH<TAB>SIZE on line '
+                                 f'{ln} in {fn}: {l}')
+            cached.setdefault(root, []).append((path, int(size)))
+    return cached
+
+
+def iter_files(inputs, cache=None, suffix=DEFAULT_SUFFIX):
+    # Yields (path, size) for each input file and for files with suffix
+    # in each input directory, using and updating cache if given
+    cached = load_cache(cache)
+    for input_ in inputs:
+        if os.path.isfile(input_):
+            yield input_, os.path.getsize(input_)
+            continue
+        root = input_.rstrip('/') or '/'
+        if root in cached:
+            yield from cached[root]
+            continue
+        found = []
+        for path, size in scan_files(root, suffix):
+            found.append((path, size))
+            yield path, size
+        if cache is not None:
+            # only cache complete scans
+            with open(cache, 'a', encoding='utf-8') as out:
+                for path, size in found:
+                    print(f'{root}\t{path}\t{size}', file=out)
+            cached[root] = found
+
+
+def iter_paths(inputs, cache=None, suffix=DEFAULT_SUFFIX):
+    for path, size in iter_files(inputs, cache, suffix):
+        yield path
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+
+    for path, size in iter_files(args.input, args.cache, args.suffix):
+        if args.sizes:
+            print(f'{path}\t{size}')
+        else:
+            print(path)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
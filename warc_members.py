@@ -0,0 +1,173 @@
+# Walk the gzip members of per-record-gzip WARC files (one record per
+# member, as in Common Crawl) inflating only the WARC headers of each
+# record.
+#
+# gzip members don't record their compressed length, so the end of a
+# member is found by searching for the next gzip magic and checking that
+# the ISIZE field of the gzip trailer before it matches the uncompressed
+# record size known from the WARC headers (headers + Content-Length +
+# the record-terminating blank lines).
+
+import mmap
+import zlib
+import struct
+
+from contextlib import contextmanager
+
+
+# gzip magic followed by compression method (deflate)
+GZIP_MAGIC = b'\x1f\x8b\x08'
+
+# Give up if WARC headers are longer than this
+MAX_HEADER_LENGTH = 65536
+
+# Compressed bytes to inflate at a time when looking for end of headers
+_HEADER_CHUNK_SIZE = 1024
+
+# Bytes to inflate at a time when reading whole members
+_MEMBER_CHUNK_SIZE = 2**16
+
+# Blank line ending WARC headers and terminating records
+_HEADER_END = b'\r\n\r\n'
+_RECORD_END = b'\r\n\r\n'
+
+# Minimum size of gzip member (header and trailer)
+_MIN_MEMBER_SIZE = 18
+
+
+class WarcHeaders:
+    # Minimal stand-in for warcio StatusAndHeaders
+    def __init__(self, protocol, headers):
+        self.protocol = protocol
+        self.headers = headers
+
+    def get_header(self, name, default_value=None):
+        name = name.lower()
+        for n, v in self.headers:
+            if n.lower() == name:
+                return v
+        return default_value
+
+
+class MemberRecord:
+    # WARC record in gzip member at offset with compressed length.
+    # Provides the subset of the warcio ArcWarcRecord interface that is
+    # available without inflating the record block.
+    def __init__(self, offset, length, rec_headers, header_length):
+        self.offset = offset
+        self.length = length
+        self.rec_headers = rec_headers
+        self.rec_type = rec_headers.get_header('WARC-Type')
+        self.header_length = header_length
+
+    @property
+    def content_length(self):
+        return int(self.rec_headers.get_header('Content-Length'))
+
+
+def parse_warc_headers(data):
+    lines = data.decode('utf-8', 'replace').split('\r\n')
+    protocol = lines[0]
+    if not protocol.startswith('WARC/'):
+        raise ValueError(f'not a WARC record: {protocol[:20]!r}')
+    headers = []
+    for line in lines[1:]:
+        if not line:
+            continue
+        if line[0] in ' \t' and headers:
+            # continuation line
+            name, value = headers[-1]
+            headers[-1] = (name, f'{value} {line.strip()}')
+            continue
+        name, sep, value = line.partition(':')
+        if not sep:
+            raise ValueError(f'invalid WARC header line: {line!r}')
+        headers.append((name.strip(), value.strip()))
+    return WarcHeaders(protocol, headers)
+
+
+def inflate_headers(buf, offset):
+    # Returns WARC headers (including the terminating blank line) of the
+    # record in the gzip member at offset, inflating as little as possible
+    if buf[offset:offset+len(GZIP_MAGIC)] != GZIP_MAGIC:
+        raise ValueError(f'no gzip member at offset {offset}')
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    data, pos = b'', offset
+    while True:
+        chunk = buf[pos:pos+_HEADER_CHUNK_SIZE]
+        if not chunk:
+            raise ValueError(f'truncated gzip member at offset {offset}')
+        pos += len(chunk)
+        data += decompressor.decompress(chunk, MAX_HEADER_LENGTH-len(data))
+        end = data.find(_HEADER_END)
+        if end != -1:
+            return data[:end+len(_HEADER_END)]
+        if len(data) >= MAX_HEADER_LENGTH or decompressor.eof:
+            raise ValueError(f'no WARC headers at offset {offset}')
+
+
+def find_member_end(buf, offset, uncompressed_size):
+    # Returns offset of the end of the gzip member starting at offset
+    # given the uncompressed size of its data
+    isize = struct.pack('<I', uncompressed_size & 0xffffffff)
+    pos = offset + _MIN_MEMBER_SIZE
+    while True:
+        end = buf.find(GZIP_MAGIC, pos)
+        if end == -1:
+            end = len(buf)
+        if buf[end-4:end] == isize:
+            return end
+        if end == len(buf):
+            raise ValueError(f'no end found for gzip member at offset '
+                             f'{offset}, not a per-record gzip WARC?')
+        pos = end + 1
+
+
+def read_member_record(buf, offset):
+    header_block = inflate_headers(buf, offset)
+    rec_headers = parse_warc_headers(header_block)
+    length = rec_headers.get_header('Content-Length')
+    if length is None:
+        raise ValueError(f'missing Content-Length at offset {offset}')
+    size = len(header_block) + int(length) + len(_RECORD_END)
+    end = find_member_end(buf, offset, size)
+    return MemberRecord(offset, end-offset, rec_headers, len(header_block))
+
+
+def inflate_member(buf, offset, length):
+    # Yields the uncompressed data of the gzip member at offset with
+    # compressed length in chunks of bounded size, so that large records
+    # are not held in memory. zlib checks the gzip CRC and ISIZE.
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    end = offset + length
+    for pos in range(offset, end, _MEMBER_CHUNK_SIZE):
+        data = buf[pos:min(pos+_MEMBER_CHUNK_SIZE, end)]
+        while data:
+            yield decompressor.decompress(data, _MEMBER_CHUNK_SIZE)
+            data = decompressor.unconsumed_tail
+    yield decompressor.flush()
+    if not decompressor.eof:
+        raise ValueError(f'truncated gzip member at offset {offset}')
+    if decompressor.unused_data:
+        raise ValueError(f'data after gzip member at offset {offset}')
+
+
+def iter_member_records(buf, offset=0):
+    while offset < len(buf):
+        record = read_member_record(buf, offset)
+        yield record
+        offset += record.length
+
+
+@contextmanager
+def mmap_file(fn):
+    with open(fn, 'rb') as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            yield b''    # cannot mmap empty file
+            return
+        try:
+            yield buf
+        finally:
+            buf.close()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+
+# Lean read-only WARC reader for header scans (record types, IDs, MIME
+# types) that don't need the full warcio machinery.
+#
+# Records are read from a memory-mapped buffer of uncompressed WARC
+# data: .warc files are mapped directly and .warc.gz files are first
+# inflated into a temporary file. Finding a record only requires
+# locating the end of its WARC headers and reading Content-Length, and
+# headers are looked up with bytes operations on the header block
+# instead of being parsed into objects. HTTP headers are located only
+# when asked for, and content is a memoryview into the buffer, so
+# records that are not used cost next to nothing.
+#
+# Records provide the subset of the warcio ArcWarcRecord interface that
+# the tools use (rec_type, rec_headers.get_header(), http_headers,
+# content_stream()). Header continuation lines are not supported.
+# Content memoryviews are only valid while the buffer is open.
+#
+# Run as a script to benchmark against warcio ArchiveIterator.
+
+import sys
+import gzip
+import mmap
+import shutil
+import tempfile
+
+from io import BytesIO
+from time import time
+from contextlib import contextmanager
+from argparse import ArgumentParser
+
+from warc_members import MAX_HEADER_LENGTH, mmap_file
+
+
+# Blank line ending headers and terminating records
+_HEADER_END = b'\r\n\r\n'
+_RECORD_END = b'\r\n\r\n'
+
+# Bytes copied at a time when inflating into a temporary file
+_INFLATE_CHUNK_SIZE = 2**20
+
+
+def argparser():
+    ap = ArgumentParser(description='Benchmark WARC reader against warcio')
+    ap.add_argument('-c', '--content', default=False, action='store_true',
+                    help='also read content of response records')
+    ap.add_argument('-n', '--repeat', metavar='N', type=int, default=1,
+                    help='repeat each measurement N times and take best')
+    ap.add_argument('warc', nargs='+')
+    return ap
+
+
+class LazyHeaders:
+    # Header block with case-insensitive lookup by searching the bytes.
+    # Provides the get_header() interface of warcio StatusAndHeaders.
+    __slots__ = ('block', '_lower')
+
+    def __init__(self, block):
+        self.block = block    # status line and headers with final CRLFs
+        self._lower = None
+
+    @property
+    def protocol(self):
+        return self._status_line().split(' ', 1)[0]
+
+    @property
+    def statusline(self):
+        parts = self._status_line().split(' ', 1)
+        return parts[1] if len(parts) > 1 else ''
+
+    def _status_line(self):
+        line = self.block[:self.block.find(b'\r\n')]
+        return line.decode('utf-8', 'replace')
+
+    def get_header(self, name, default_value=None):
+        if self._lower is None:
+            self._lower = self.block.lower()
+        key = b'\r\n' + name.lower().encode('ascii') + b':'
+        start = self._lower.find(key)
+        if start == -1:
+            return default_value
+        start += len(key)
+        end = self.block.find(b'\r\n', start)
+        return self.block[start:end].strip().decode('utf-8', 'replace')
+
+    @property
+    def headers(self):
+        # All headers as (name, value) list
+        lines = self.block.decode('utf-8', 'replace').split('\r\n')[1:]
+        headers = []
+        for line in lines:
+            name, sep, value = line.partition(':')
+            if sep:
+                headers.append((name.strip(), value.strip()))
+        return headers
+
+
+class FastRecord:
+    # WARC record at offset in buffer
+    __slots__ = ('buf', 'offset', 'rec_headers', 'content_offset', 'length',
+                 '_http')
+
+    def __init__(self, buf, offset, rec_headers, content_offset, length):
+        self.buf = buf
+        self.offset = offset
+        self.rec_headers = rec_headers
+        self.content_offset = content_offset
+        self.length = length
+        self._http = None
+
+    @property
+    def rec_type(self):
+        return self.rec_headers.get_header('WARC-Type')
+
+    @property
+    def end(self):
+        # Offset after the record and its terminating blank lines
+        return self.content_offset + self.length + len(_RECORD_END)
+
+    @property
+    def content(self):
+        # Record block (HTTP headers and payload for responses)
+        start = self.content_offset
+        return memoryview(self.buf)[start:start+self.length]
+
+    @property
+    def raw(self):
+        # Whole record as in the input, e.g. for copying it out
+        return memoryview(self.buf)[self.offset:self.end]
+
+    def _parse_http(self):
+        # Returns (HTTP headers or None, payload offset in content)
+        if self._http is not None:
+            return self._http
+        self._http = (None, 0)
+        if self.rec_type in ('response', 'request'):
+            start = self.content_offset
+            stop = start + min(self.length, MAX_HEADER_LENGTH)
+            if self.buf[start:start+5] == b'HTTP/' or \
+               self.rec_type == 'request':
+                end = self.buf.find(_HEADER_END, start, stop)
+                if end != -1:
+                    end += len(_HEADER_END)
+                    block = self.buf[start:end]
+                    self._http = (LazyHeaders(block), end-start)
+        return self._http
+
+    @property
+    def http_headers(self):
+        return self._parse_http()[0]
+
+    @property
+    def payload(self):
+        # Payload as in the record, without decoding transfer or content
+        # encoding
+        return self.content[self._parse_http()[1]:]
+
+    @property
+    def payload_length(self):
+        return self.length - self._parse_http()[1]
+
+    def content_stream(self):
+        # Payload decoded as by warcio: encoded payloads (rare) are handed
+        # to warcio readers, others are read from the buffer directly
+        http_headers = self.http_headers
+        payload = self.payload
+        if http_headers is None:
+            return BytesIO(payload)
+        encoding = http_headers.get_header('Content-Encoding')
+        chunked = http_headers.get_header('Transfer-Encoding') == 'chunked'
+        if not encoding and not chunked:
+            return BytesIO(payload)
+        from warcio.bufferedreaders import BufferedReader, ChunkedDataReader
+        if encoding:
+            encoding = encoding.lower()
+            if encoding not in BufferedReader.get_supported_decompressors():
+                encoding = None
+        if chunked:
+            return ChunkedDataReader(BytesIO(payload), decomp_type=encoding)
+        elif encoding:
+            return BufferedReader(BytesIO(payload), decomp_type=encoding)
+        else:
+            return BytesIO(payload)
+
+
+def read_record(buf, offset):
+    end = buf.find(_HEADER_END, offset, offset+MAX_HEADER_LENGTH)
+    if end == -1:
+        raise ValueError(f'no WARC headers at offset {offset}')
+    end += len(_HEADER_END)
+    if buf[offset:offset+5] != b'WARC/':
+        raise ValueError(f'not a WARC record at offset {offset}')
+    rec_headers = LazyHeaders(buf[offset:end])
+    length = rec_headers.get_header('Content-Length')
+    if length is None:
+        raise ValueError(f'missing Content-Length at offset {offset}')
+    record = FastRecord(buf, offset, rec_headers, end, int(length))
+    if record.end > len(buf):
+        raise ValueError(f'truncated record at offset {offset}')
+    if buf[record.end-len(_RECORD_END):record.end] != _RECORD_END:
+        raise ValueError(f'no record end for record at offset {offset}')
+    return record
+
+
+def iter_records(buf, offset=0):
+    size = len(buf)
+    while offset < size:
+        # tolerate extra blank lines between records
+        while buf[offset:offset+2] == b'\r\n':
+            offset += 2
+        if offset >= size:
+            break
+        record = read_record(buf, offset)
+        yield record
+        offset = record.end
+
+
+@contextmanager
+def open_warc_buffer(fn, tmpdir=None):
+    # Yields read-only buffer with the uncompressed WARC data in fn.
+    # Compressed files are inflated into an unlinked temporary file (in
+    # tmpdir, default TMPDIR), so memory use doesn't grow with file size.
+    if not fn.endswith('.gz'):
+        with mmap_file(fn) as buf:
+            yield buf
+        return
+    with tempfile.TemporaryFile(dir=tmpdir) as tmp:
+        with gzip.open(fn) as f:
+            shutil.copyfileobj(f, tmp, _INFLATE_CHUNK_SIZE)
+        tmp.flush()
+        try:
+            buf = mmap.mmap(tmp.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            yield b''    # cannot mmap empty file
+            return
+        try:
+            yield buf
+        finally:
+            buf.close()
+
+
+def scan_record(record, content):
+    # The work done per record in the benchmark
+    rec_type = record.rec_type
+    id_ = record.rec_headers.get_header('WARC-Record-ID')
+    type_ = record.rec_headers.get_header('WARC-Identified-Payload-Type')
+    length = None
+    if content and rec_type == 'response':
+        length = len(record.content_stream().read())
+    return rec_type, id_, type_, length
+
+
+def scan_warcio(fn, content):
+    from warcio.archiveiterator import ArchiveIterator    # deferred
+    xopen = gzip.open if fn.endswith('.gz') else open
+    with xopen(fn, 'rb') as f:
+        return [scan_record(r, content) for r in ArchiveIterator(f)]
+
+
+def scan_fast(fn, content):
+    with open_warc_buffer(fn) as buf:
+        return [scan_record(r, content) for r in iter_records(buf)]
+
+
+def inflate_only(fn):
+    with open_warc_buffer(fn) as buf:
+        return len(buf)
+
+
+def best_time(func, repeat, *args):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time()
+        result = func(*args)
+        elapsed = time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+
+    for fn in args.warc:
+        t_warcio, expected = best_time(scan_warcio, args.repeat, fn,
+                                       args.content)
+        t_fast, found = best_time(scan_fast, args.repeat, fn, args.content)
+        t_inflate, size = best_time(inflate_only, args.repeat, fn)
+        if found != expected:
+            print(f'{fn}: MISMATCH: warcio {len(expected)} records, '
+                  f'fast {len(found)} records', file=sys.stderr)
+        records = len(expected)
+        rate = lambda t: records / max(t, 1e-9)
+        print(f'{fn}: {records} records, {size/2**20:.1f} MB uncompressed; '
+              f'warcio {t_warcio:.3f}s ({rate(t_warcio):.0f} records/s), '
+              f'fast {t_fast:.3f}s ({rate(t_fast):.0f} records/s, '
+              f'of which buffering {t_inflate:.3f}s); '
+              f'speedup {t_warcio/max(t_fast, 1e-9):.1f}x')
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
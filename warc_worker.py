@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+# Long-lived worker that loads models and extractors once and processes
+# file jobs submitted over a Unix socket, avoiding per-file startup cost.
+#
+# Start a worker on a node:
+#     python warc_worker.py serve /tmp/warc-worker.sock -j 40 -m lid.176.bin
+# Submit a job and wait for its completion:
+#     python warc_worker.py submit /tmp/warc-worker.sock convert IN OUT -- -e cascade
+
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import logging
+import socketserver
+import multiprocessing
+
+from contextlib import redirect_stdout
+from collections import defaultdict
+from argparse import ArgumentParser
+
+
+# Supported tools
+_TOOLS = [
+    'convert',       # convert_warc.py
+    'langdetect',    # langdetect_warc.py
+    'hashes',        # compute_warc_hashes.py
+]
+
+# Extractors to initialize at worker startup by default
+DEFAULT_PRELOAD = 'trafilatura'
+
+# Minimal HTML document for warming up extractors
+_WARMUP_HTML = b'<html><body><p>Warm-up document.</p></body></html>'
+
+# FastText model loaded in serve() before forking workers so that its
+# memory is shared between them
+_model_path = None
+_model = None
+
+
+def argparser():
+    ap = ArgumentParser(description='Process WARC file jobs in a worker pool')
+    sp = ap.add_subparsers(dest='command', metavar='COMMAND')
+    sp.required = True
+
+    serve = sp.add_parser('serve', help='start worker')
+    serve.add_argument('socket', help='path of Unix socket to listen on')
+    serve.add_argument('-j', '--processes', metavar='N', type=int,
+                       default=os.cpu_count(),
+                       help='number of worker processes')
+    serve.add_argument('-m', '--model', default=None,
+                       help='FastText model (required for langdetect)')
+    serve.add_argument('-p', '--preload', metavar='EXTRACTOR[,EXTRACTOR...]',
+                       default=DEFAULT_PRELOAD,
+                       help='extractors to initialize at startup')
+    serve.add_argument('-v', '--verbose', default=False, action='store_true')
+
+    submit = sp.add_parser('submit', help='submit job and wait for it')
+    submit.add_argument('socket', help='path of worker Unix socket')
+    submit.add_argument('tool', choices=_TOOLS)
+    submit.add_argument('input', help='input WARC file')
+    submit.add_argument('output', help='output file')
+    submit.add_argument('options', nargs='*',
+                        help='tool options (give after "--")')
+    return ap
+
+
+def init_worker(preload, loglevel):
+    logging.basicConfig()
+    logging.getLogger().setLevel(loglevel)
+    logging.getLogger('trafilatura').setLevel(logging.CRITICAL)
+
+    import convert_warc
+    for extractor in preload:
+        try:
+            convert_warc.run_extractor(extractor, _WARMUP_HTML, None, None)
+        except Exception as e:
+            logging.warning(f'failed to initialize {extractor}: {e}')
+
+
+def check_options(args):
+    # the memory profiler and tracemalloc are per process and would carry
+    # over from job to job, and their report is not returned
+    if args.memory_profile or args.tracemalloc:
+        raise ValueError('--memory-profile and --tracemalloc are not '
+                         'supported in the worker')
+    return args
+
+
+def run_tool(tool, input_, options, stats):
+    if tool == 'convert':
+        import convert_warc
+        args = check_options(convert_warc.prepare_args(
+            convert_warc.argparser().parse_args(options + [input_])))
+        convert_warc.convert_warc(input_, stats, args)
+    elif tool == 'langdetect':
+        import langdetect_warc
+        if _model is None:
+            raise ValueError('langdetect requires worker started with --model')
+        args = check_options(langdetect_warc.prepare_args(
+            langdetect_warc.argparser().parse_args(
+                options + [_model_path, input_])))
+        langdetect_warc.langdetect_warc(input_, _model, stats, args)
+    elif tool == 'hashes':
+        import compute_warc_hashes
+        args = check_options(compute_warc_hashes.argparser().parse_args(
+            options + [input_]))
+        compute_warc_hashes.compute_hashes(input_, stats, args)
+    else:
+        raise ValueError(tool)
+
+
+def run_job(job):
+    start = time.time()
+    stats = defaultdict(int)
+    output = job['output']
+    tmp_output = f'{output}.tmp'
+    try:
+        # tools print to stdout; write to temporary file and rename on
+        # success so that partial outputs never look complete
+        with open(tmp_output, 'w', encoding='utf-8') as out:
+            with redirect_stdout(out):
+                run_tool(job['tool'], job['input'], job['options'], stats)
+        os.replace(tmp_output, output)
+    except (Exception, SystemExit) as e:
+        if os.path.exists(tmp_output):
+            os.remove(tmp_output)
+        if isinstance(e, SystemExit):    # raised by argparse
+            error = f'invalid options for {job["tool"]}: {job["options"]}'
+        else:
+            error = f'{type(e).__name__}: {e}'
+        return {
+            'status': 'error',
+            'error': error,
+            'pid': os.getpid(),
+        }
+    return {
+        'status': 'ok',
+        'stats': dict(stats),
+        'seconds': round(time.time()-start, 3),
+        'pid': os.getpid(),
+    }
+
+
+def parse_job(line):
+    job = json.loads(line)
+    for key in ('tool', 'input', 'output'):
+        if key not in job:
+            raise ValueError(f'missing "{key}"')
+    if job['tool'] not in _TOOLS:
+        raise ValueError(f'unknown tool {job["tool"]}')
+    job['input'] = os.path.abspath(job['input'])
+    job['output'] = os.path.abspath(job['output'])
+    job.setdefault('options', [])
+    return job
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            job = parse_job(line)
+        except Exception as e:
+            result = {'status': 'error', 'error': f'invalid job: {e}'}
+        else:
+            logging.info(f'start {job["tool"]} {job["input"]}')
+            result = self.server.pool.apply(run_job, (job,))
+            logging.info(f'{result["status"]} {job["tool"]} {job["input"]}')
+        self.wfile.write(json.dumps(result).encode('utf-8') + b'\n')
+
+
+class WorkerServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, pool):
+        super().__init__(path, JobHandler)
+        self.pool = pool
+
+
+def serve(args):
+    global _model_path, _model
+
+    loglevel = logging.INFO if args.verbose else logging.WARNING
+    logging.getLogger().setLevel(loglevel)
+
+    preload = [e for e in args.preload.split(',') if e]
+    if os.path.exists(args.socket):
+        os.remove(args.socket)    # stale socket from previous run
+
+    if args.model is not None:
+        import fasttext
+        _model_path = args.model
+        _model = fasttext.load_model(args.model)
+
+    context = multiprocessing.get_context('fork')
+    initargs = (preload, loglevel)
+    with context.Pool(args.processes, init_worker, initargs) as pool:
+        # shut down cleanly on SIGTERM (e.g. scancel or end of job)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        with WorkerServer(args.socket, pool) as server:
+            print(f'warc_worker.py: serving {args.socket} with '
+                  f'{args.processes} processes', file=sys.stderr)
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os.remove(args.socket)
+
+
+def submit(args):
+    job = {
+        'tool': args.tool,
+        'input': os.path.abspath(args.input),
+        'output': os.path.abspath(args.output),
+        'options': args.options,
+    }
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(args.socket)
+        s.sendall(json.dumps(job).encode('utf-8') + b'\n')
+        with s.makefile('rb') as f:
+            result = json.loads(f.readline())
+
+    if result['status'] != 'ok':
+        print(f'{args.input}: ERROR: {result["error"]}', file=sys.stderr)
+        return 1
+    stats = ', '.join(f'{v} {k}' for k, v in result['stats'].items())
+    print(f'{args.input}: OK in {result["seconds"]} sec: {stats}',
+          file=sys.stderr)
+    return 0
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+
+    logging.basicConfig()
+
+    if args.command == 'serve':
+        return serve(args)
+    else:
+        return submit(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
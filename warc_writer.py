@@ -0,0 +1,110 @@
+# WARC writer that compresses records in background threads.
+#
+# Records are serialized on the calling thread and each is compressed
+# into its own gzip member (or zstd frame) by a thread pool. zlib and
+# zstandard release the GIL while compressing, so reading and parsing
+# input proceeds concurrently with compression. Members are written in
+# the order the records were given, and at most max_pending records
+# are queued at a time so that a slow output applies backpressure.
+
+import zlib
+
+from io import BytesIO
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from warcio import WARCWriter
+
+
+# Supported per-record compressions
+COMPRESSIONS = ['gzip', 'zstd']
+
+# Same as warcio GzippingWrapper so that output is identical
+GZIP_LEVEL = 9
+
+
+def gzip_compress(data, level=GZIP_LEVEL):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS + 16)
+    return compressor.compress(data) + compressor.flush()
+
+
+def zstd_compress(data, level=3):
+    import zstandard
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+class ThreadedWARCWriter:
+    def __init__(self, out, threads=2, compression='gzip', max_pending=None):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f'unknown compression {compression}')
+        self.out = out
+        self.compress = gzip_compress if compression == 'gzip' else \
+            zstd_compress
+        self.max_pending = max_pending or 4 * threads
+        self.pending = deque()
+        self.executor = ThreadPoolExecutor(threads)
+        self.buffer = BytesIO()
+        self.serializer = WARCWriter(self.buffer, gzip=False)
+
+    def write_record(self, record, params=None):
+        try:
+            self.serializer.write_record(record, params)
+            data = self.buffer.getvalue()
+        finally:
+            # drop partial output of a failed record so that it is not
+            # prepended to the next one
+            self.buffer.seek(0)
+            self.buffer.truncate()
+        self.pending.append(self.executor.submit(self.compress, data))
+        # write out what's done, blocking if the queue is full
+        while self.pending and (self.pending[0].done() or
+                                len(self.pending) > self.max_pending):
+            self.out.write(self.pending.popleft().result())
+
+    def close(self):
+        while self.pending:
+            self.out.write(self.pending.popleft().result())
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_warc_writer(out, threads=0):
+    # WARCWriter writing per-record gzip members, compressing in threads
+    # background threads if threads > 0. Use as context manager; out is
+    # flushed only on exit, so buffered outputs are written in blocks.
+    if threads > 0:
+        return ThreadedWARCWriter(out, threads)
+    else:
+        return _ContextWARCWriter(out, gzip=True)
+
+
+class _NoFlushOutput:
+    # Output ignoring flush(), which warcio calls after every record and
+    # which would write out the buffer of a buffered file each time
+    def __init__(self, out):
+        self.out = out
+
+    def write(self, data):
+        return self.out.write(data)
+
+    def flush(self):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self.out, name)
+
+
+class _ContextWARCWriter(WARCWriter):
+    def __init__(self, out, **kwargs):
+        super().__init__(_NoFlushOutput(out), **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.out.out.flush()